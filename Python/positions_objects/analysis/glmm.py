@@ -0,0 +1,428 @@
+import itertools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from profiling import profiler
+
+# Reference levels follow R's alphabetical factor levels, so the coefficients
+# line up with fixef(model_lmer) in R/glmm.R
+FACTORS = ['Position', 'Object']
+CHUNK_SIZE = 100
+_LOG_THETA_BOUNDS = (-15.0, 8.0)
+_GOLDEN_ITERATIONS = 60
+# Random draws of participants tried per number of participants of the power
+# curve before giving up on a subset whose design has full rank.
+SUBSET_ATTEMPTS = 100
+
+
+def design_matrix(data, factors=FACTORS):
+    """
+        Builds the treatment-coded design matrix of the full factorial model
+        (e.g. Position * Object), as model.matrix does in R.
+
+        Parameters:
+        data (DataFrame): Rows of the model, with a column per factor.
+        factors (list): Factor columns; their levels are sorted as in R.
+
+        Returns:
+        tuple: (X, column names, levels of every factor).
+    """
+    levels = [sorted(pd.Series(data[factor]).astype(str).unique()) for factor in factors]
+    dummies = [[(pd.Series(data[factor]).astype(str) == level).to_numpy(float) for level in factor_levels[1:]]
+               for factor, factor_levels in zip(factors, levels)]
+    names_per_factor = [[f'{factor}{level}' for level in factor_levels[1:]]
+                        for factor, factor_levels in zip(factors, levels)]
+
+    columns = [np.ones(len(data))]
+    names = ['(Intercept)']
+    for order in range(1, len(factors) + 1):
+        for subset in itertools.combinations(range(len(factors)), order):
+            for combination in itertools.product(*[range(len(dummies[i])) for i in subset]):
+                columns.append(np.prod([dummies[i][j] for i, j in zip(subset, combination)], axis=0))
+                names.append(':'.join(names_per_factor[i][j] for i, j in zip(subset, combination)))
+    return np.column_stack(columns), names, levels
+
+
+def _independent_columns(X):
+    """
+        Columns of X kept, in order, dropping every column that is a linear
+        combination of the ones before it (e.g. the interaction of a
+        Position x Object cell without rows), as lmer does for a rank-deficient
+        design.
+    """
+    rows = np.unique(X, axis=0)
+    kept = []
+    for j in range(X.shape[1]):
+        if np.linalg.matrix_rank(rows[:, kept + [j]]) > len(kept):
+            kept.append(j)
+    return np.array(kept, dtype=int)
+
+
+def _cell_matrix(levels, names, factors=FACTORS):
+    """
+        Rows of the design matrix of every cell (combination of factor levels),
+        i.e. the linear combinations of the coefficients giving the cell means.
+    """
+    cells = pd.DataFrame(list(itertools.product(*levels)), columns=factors)
+    L, _, _ = design_matrix(cells, factors)
+    return cells, L
+
+
+def _group_sums(values, starts):
+    return np.add.reduceat(values, starts, axis=-1)
+
+
+def _profiled_reml(log_theta, XtX, S, n_g, Xty, ysum, yty, n, p):
+    """
+        -2 REML log likelihood of the random intercept model, profiled over the
+        fixed effects and the residual variance, for every simulation at once.
+        theta is the ratio of the random intercept to the residual variance.
+
+        Parameters:
+        log_theta (ndarray): (nsim,) log variance ratios.
+        XtX (ndarray): (p, p) X'X.
+        S (ndarray): (G, p) column sums of X per group.
+        n_g (ndarray): (G,) rows per group.
+        Xty, ysum, yty (ndarray): (nsim, p) X'y, (nsim, G) sums of y per group
+                                  and (nsim,) y'y.
+
+        Returns:
+        tuple: (-2 REML, beta (nsim, p), (X'H^-1 X)^-1 (nsim, p, p), RSS (nsim,)).
+    """
+    theta = np.exp(log_theta)
+    w = theta[:, None] / (1 + n_g[None, :] * theta[:, None])
+    XtHX = XtX[None] - np.einsum('kg,gi,gj->kij', w, S, S)
+    XtHy = Xty - np.einsum('kg,gi,kg->ki', w, S, ysum)
+    yHy = yty - np.einsum('kg,kg->k', w, ysum ** 2)
+    XtHX_inv = np.linalg.inv(XtHX)
+    beta = np.einsum('kij,kj->ki', XtHX_inv, XtHy)
+    rss = yHy - np.einsum('ki,ki->k', beta, XtHy)
+    logdet_H = np.log1p(n_g[None, :] * theta[:, None]).sum(axis=1)
+    _, logdet_XtHX = np.linalg.slogdet(XtHX)
+    return (n - p) * np.log(rss) + logdet_H + logdet_XtHX, beta, XtHX_inv, rss
+
+
+def _fit_many(X, starts, Y):
+    """
+        Fits the random intercept model to every row of Y (REML), sharing the
+        design across fits. The variance ratio of all fits is found by one
+        vectorised golden-section search.
+
+        Parameters:
+        X (ndarray): (n, p) design matrix, rows sorted by group.
+        starts (ndarray): First row of every group.
+        Y (ndarray): (nsim, n) responses.
+
+        Returns:
+        dict: beta (nsim, p), se (nsim, p), sigma (nsim,), sigma_id (nsim,).
+    """
+    n, p = X.shape
+    n_g = np.diff(np.append(starts, n)).astype(float)
+    S = _group_sums(X.T, starts).T
+    XtX = X.T @ X
+    Xty = Y @ X
+    ysum = _group_sums(Y, starts)
+    yty = np.einsum('kn,kn->k', Y, Y)
+    args = (XtX, S, n_g, Xty, ysum, yty, n, p)
+
+    ratio = (np.sqrt(5) - 1) / 2
+    lower = np.full(len(Y), _LOG_THETA_BOUNDS[0])
+    upper = np.full(len(Y), _LOG_THETA_BOUNDS[1])
+    x1 = upper - ratio * (upper - lower)
+    x2 = lower + ratio * (upper - lower)
+    f1 = _profiled_reml(x1, *args)[0]
+    f2 = _profiled_reml(x2, *args)[0]
+    for _ in range(_GOLDEN_ITERATIONS):
+        left = f1 < f2
+        upper = np.where(left, x2, upper)
+        lower = np.where(left, lower, x1)
+        new = np.where(left, upper - ratio * (upper - lower), lower + ratio * (upper - lower))
+        f_new = _profiled_reml(new, *args)[0]
+        x1, x2, f1, f2 = (np.where(left, new, x2), np.where(left, x1, new),
+                          np.where(left, f_new, f2), np.where(left, f1, f_new))
+
+    log_theta = (lower + upper) / 2
+    _, beta, XtHX_inv, rss = _profiled_reml(log_theta, *args)
+    sigma2 = rss / (n - p)
+    se = np.sqrt(sigma2[:, None] * np.diagonal(XtHX_inv, axis1=1, axis2=2))
+    return {'beta': beta, 'se': se, 'cov': sigma2[:, None, None] * XtHX_inv,
+            'sigma': np.sqrt(sigma2), 'sigma_id': np.sqrt(np.exp(log_theta) * sigma2)}
+
+
+def _sorted_by_group(data, group):
+    data = data.sort_values(group, kind='mergesort')
+    ids = data[group].to_numpy()
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    return data, starts
+
+
+@profiler.stage('fit_lmm')
+def fit_lmm(data, y_var='Duration', group='id', factors=FACTORS, log=True):
+    """
+        Fits y_var ~ Position * Object + (1 | id) by REML, the log-scale model of
+        the sensitivity analysis in R/glmm.R (lmer(logY_var ~ ...)). This is a
+        linear mixed model approximating the Gamma-log GLMM of the paper, not that
+        GLMM itself: on the log scale the back-transformed cell means are the
+        geometric means the GLMM estimates up to its shape, but the tests and
+        intervals differ, and R/glmm.R remains the reference.
+
+        Columns of a rank-deficient design (e.g. a cell without rows) are dropped
+        as by lmer, with a warning, and their coefficients reported as NaN; cells
+        that are not estimable then get NaN estimates and no comparisons.
+
+        Parameters:
+        data (DataFrame): e.g. sampling_across_positions (y_var='Duration') or
+                          the rows of extract_sampling_per_id with a count
+                          (y_var='count_per_min').
+        group (str): Column of the random intercept.
+        log (bool): Model log(y_var); rows with y_var <= 0 are dropped.
+
+        Returns:
+        dict: coef (DataFrame of Estimate, Std. Error, t value), cov (their
+              covariance), sigma, sigma_id, r2 (marginal, conditional), aliased
+              (dropped columns), and the design used by the other functions of
+              this module.
+    """
+    data = data[list(factors) + [group, y_var]]
+    if log:
+        data = data[data[y_var] > 0]
+    data, starts = _sorted_by_group(data, group)
+    X, names, levels = design_matrix(data, factors)
+    kept = _independent_columns(X)
+    aliased = [name for j, name in enumerate(names) if j not in kept]
+    if aliased:
+        warnings.warn(f"Fixed-effect model matrix of {y_var} is rank deficient, dropping {', '.join(aliased)}")
+    cells, L = _cell_matrix(levels, names, factors)
+    # A cell is estimable if its row lies in the row space of the design.
+    rows = np.unique(X, axis=0)
+    solution = np.linalg.lstsq(rows.T, L.T, rcond=None)[0]
+    estimable = np.all(np.isclose(rows.T @ solution, L.T), axis=0)
+    X = X[:, kept]
+    y = data[y_var].to_numpy(float)
+    if log:
+        y = np.log(y)
+
+    fit = _fit_many(X, starts, y[None, :])
+    sigma, sigma_id = fit['sigma'][0], fit['sigma_id'][0]
+    fixed_variance = np.var(X @ fit['beta'][0])
+    total = fixed_variance + sigma_id ** 2 + sigma ** 2
+    beta = np.full(len(names), np.nan)
+    se = np.full(len(names), np.nan)
+    cov = np.full((len(names), len(names)), np.nan)
+    beta[kept], se[kept], cov[np.ix_(kept, kept)] = fit['beta'][0], fit['se'][0], fit['cov'][0]
+    return {'coef': pd.DataFrame({'Estimate': beta, 'Std. Error': se, 't value': beta / se}, index=names),
+            'cov': cov, 'sigma': sigma, 'sigma_id': sigma_id,
+            'r2': {'marginal': float(fixed_variance / total),
+                   'conditional': float((fixed_variance + sigma_id ** 2) / total)},
+            'aliased': aliased, 'kept': kept, 'estimable': estimable,
+            'X': X, 'starts': starts, 'ids': data[group].to_numpy()[starts], 'levels': levels,
+            'factors': list(factors), 'log': log, 'df': len(y) - len(kept)}
+
+
+def _estimates(fit):
+    """
+        Coefficients and covariance with the aliased columns set to 0, which gives
+        the same estimate and variance of every estimable combination as lmer.
+    """
+    beta = np.nan_to_num(fit['coef']['Estimate'].to_numpy())
+    return beta, np.nan_to_num(fit['cov'])
+
+
+def anova_type3(fit):
+    """
+        Wald chi-square tests of every model term, as car::Anova(type = "III").
+    """
+    coef = fit['coef']
+    terms = {}
+    for i, name in enumerate(coef.index):
+        term = ':'.join(next(factor for factor in fit['factors'] if part.startswith(factor))
+                        for part in name.split(':')) if i else '(Intercept)'
+        terms.setdefault(term, []).append(i)
+    rows = []
+    for term, columns in terms.items():
+        columns = [i for i in columns if coef.index[i] not in fit['aliased']]
+        if not columns:
+            continue
+        beta = coef['Estimate'].to_numpy()[columns]
+        chisq = float(beta @ np.linalg.solve(fit['cov'][np.ix_(columns, columns)], beta))
+        rows.append((term, chisq, len(columns), stats.chi2.sf(chisq, len(columns))))
+    return pd.DataFrame(rows, columns=['term', 'Chisq', 'Df', 'Pr(>Chisq)']).set_index('term')
+
+
+def cell_estimates(fit, level=0.95):
+    """
+        Estimated marginal means of every Position x Object cell, as
+        emmeans(~ Position * Object, type = "response").
+
+        Returns:
+        DataFrame: the factors, emmean and SE on the model scale, and response,
+                   lower.CL and upper.CL back-transformed if the model is on
+                   the log scale; NaN for cells that are not estimable.
+    """
+    cells, L = _cell_matrix(fit['levels'], list(fit['coef'].index), fit['factors'])
+    beta, cov = _estimates(fit)
+    emmean = np.where(fit['estimable'], L @ beta, np.nan)
+    se = np.where(fit['estimable'], np.sqrt(np.einsum('ci,ij,cj->c', L, cov, L)), np.nan)
+    half = stats.t.ppf((1 + level) / 2, fit['df']) * se
+    back = np.exp if fit['log'] else (lambda values: values)
+    return cells.assign(emmean=emmean, SE=se, response=back(emmean),
+                        **{'lower.CL': back(emmean - half), 'upper.CL': back(emmean + half)})
+
+
+def pairwise_comparisons(fit):
+    """
+        Tukey-adjusted pairwise comparisons of the cells, as pairs(emm, adjust =
+        "tukey") in R/glmm.R, in the format read by plotting.plot_data
+        read_comparisons. On the log scale the contrasts are ratios
+        ("A / B"), otherwise differences ("A - B"). Degrees of freedom are the
+        residual ones (n - p) rather than Kenward-Roger. Cells that are not
+        estimable are left out.
+    """
+    cells, L = _cell_matrix(fit['levels'], list(fit['coef'].index), fit['factors'])
+    cells, L = cells[fit['estimable']], L[fit['estimable']]
+    labels = cells.astype(str).agg(' '.join, axis=1).tolist()
+    beta, cov = _estimates(fit)
+    rows = []
+    for i, j in itertools.combinations(range(len(cells)), 2):
+        contrast = L[i] - L[j]
+        estimate = contrast @ beta
+        se = np.sqrt(contrast @ cov @ contrast)
+        t_ratio = estimate / se
+        p_value = stats.studentized_range.sf(np.sqrt(2) * abs(t_ratio), len(cells), fit['df'])
+        sep = ' / ' if fit['log'] else ' - '
+        rows.append((f'{labels[i]}{sep}{labels[j]}', np.exp(estimate) if fit['log'] else estimate, se,
+                     fit['df'], t_ratio, min(p_value, 1.0)))
+    return pd.DataFrame(rows, columns=['contrast', 'ratio' if fit['log'] else 'estimate', 'SE', 'df', 't.ratio',
+                                       'p.value'])
+
+
+def _simulate_chunk(X, starts, beta, sigma, sigma_id, nsim, seed):
+    rng = np.random.default_rng(seed)
+    n_g = np.diff(np.append(starts, len(X)))
+    b = rng.normal(0, sigma_id, (nsim, len(starts)))
+    Y = X @ beta + np.repeat(b, n_g, axis=1) + rng.normal(0, sigma, (nsim, len(X)))
+    fit = _fit_many(X, starts, Y)
+    return fit['beta'], fit['se']
+
+
+def _simulate(X, starts, beta, sigma, sigma_id, nsim, seed, workers):
+    """
+        Simulates nsim responses from the fitted model on the design X and refits
+        each, in chunks of CHUNK_SIZE spread over workers processes. Every chunk
+        has its own seed, so the result does not depend on workers.
+
+        Returns:
+        tuple: beta (nsim, p) and se (nsim, p) of the refitted models.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(-(-nsim // CHUNK_SIZE))
+    sizes = [min(CHUNK_SIZE, nsim - i * CHUNK_SIZE) for i in range(len(seeds))]
+    chunks = [(X, starts, beta, sigma, sigma_id, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*chunks)))
+    else:
+        results = [_simulate_chunk(*chunk) for chunk in chunks]
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+@profiler.stage('bootstrap_cells')
+def bootstrap_cells(fit, nsim=1000, workers=1, seed=0, level=0.95):
+    """
+        Parametric bootstrap of the cell means: responses are simulated from the
+        fitted model, the model is refitted to each, and the percentile interval
+        of every back-transformed cell mean is returned.
+
+        Parameters:
+        fit (dict): Output of fit_lmm.
+        nsim (int): Number of bootstrap samples.
+        workers (int): Processes the simulations are spread over.
+        seed (int): Seed; the result is the same for any number of workers.
+
+        Returns:
+        DataFrame: cell_estimates with boot.lower and boot.upper.
+    """
+    beta = fit['coef']['Estimate'].to_numpy()[fit['kept']]
+    betas, _ = _simulate(fit['X'], fit['starts'], beta, fit['sigma'], fit['sigma_id'], nsim, seed, workers)
+    _, L = _cell_matrix(fit['levels'], list(fit['coef'].index), fit['factors'])
+    means = betas @ L[:, fit['kept']].T
+    if fit['log']:
+        means = np.exp(means)
+    lower, upper = np.percentile(means, [50 * (1 - level), 50 * (1 + level)], axis=0)
+    lower, upper = np.where(fit['estimable'], lower, np.nan), np.where(fit['estimable'], upper, np.nan)
+    return cell_estimates(fit, level).assign(**{'boot.lower': lower, 'boot.upper': upper})
+
+
+def _participant_rows(starts, n, groups):
+    """
+        Rows of the participants groups (indices into starts) of a design sorted by
+        group, and the first row of every one of them in the subset.
+    """
+    ends = np.append(starts[1:], n)
+    sizes = ends[groups] - starts[groups]
+    rows = np.concatenate([np.arange(starts[g], ends[g]) for g in groups])
+    return rows, np.cumsum(sizes) - sizes
+
+
+@profiler.stage('power_curve')
+def power_curve(fit, effect=None, nsim=1000, breaks=None, workers=1, seed=0, alpha=0.05):
+    """
+        Power to detect a fixed effect as a function of the number of
+        participants, as simr::powerCurve(model_lmer, fixed(effect, "t")) in
+        R/glmm.R: for k participants drawn at random the fitted model is simulated
+        nsim times and refitted, and power is the share of fits with a significant
+        effect (z test of the t value). Unlike simr, which takes the first k
+        participants, the draw is repeated (up to SUBSET_ATTEMPTS times) until the
+        participants cover every estimable coefficient; a number of participants
+        for which no such draw is found is skipped with a warning, and so is the
+        whole curve if the effect itself is aliased.
+
+        Parameters:
+        fit (dict): Output of fit_lmm.
+        effect (str): Coefficient tested; the 4th one (the interaction) by default,
+                      like effect_name in R/glmm.R.
+        nsim (int): Simulations per number of participants.
+        breaks (list): Numbers of participants; up to 10 values from 3 to all of
+                       them by default, like simr.
+        workers (int): Processes the simulations are spread over.
+        seed (int): Seed; the result is the same for any number of workers.
+        alpha (float): Significance level.
+
+        Returns:
+        DataFrame: n_ids, successes, nsim, power, lower and upper (95%
+                   Clopper-Pearson interval).
+    """
+    names = list(fit['coef'].index)
+    effect = effect if effect is not None else names[3]
+    columns = ['n_ids', 'successes', 'nsim', 'power', 'lower', 'upper']
+    if effect in fit['aliased']:
+        warnings.warn(f"{effect} is aliased in the fitted model; no power curve")
+        return pd.DataFrame(columns=columns)
+    column = list(fit['kept']).index(names.index(effect))
+    beta = fit['coef']['Estimate'].to_numpy()[fit['kept']]
+    X, starts = fit['X'], fit['starts']
+    n_ids = len(starts)
+    if breaks is None:
+        breaks = np.unique(np.round(np.linspace(min(3, n_ids), n_ids, 10)).astype(int))
+    critical = stats.norm.isf(alpha / 2)
+    rows = []
+    for k in breaks:
+        rng = np.random.default_rng([seed, int(k), 1])
+        for _ in range(SUBSET_ATTEMPTS if k < n_ids else 1):
+            groups = np.sort(rng.choice(n_ids, int(k), replace=False)) if k < n_ids else np.arange(n_ids)
+            subset, subset_starts = _participant_rows(starts, len(X), groups)
+            if np.linalg.matrix_rank(np.unique(X[subset], axis=0)) == X.shape[1]:
+                break
+        else:
+            warnings.warn(f"No {k} participants out of {n_ids} cover every coefficient; skipping them in the power curve")
+            continue
+        betas, ses = _simulate(X[subset], subset_starts, beta, fit['sigma'], fit['sigma_id'],
+                               nsim, [seed, int(k)], workers)
+        successes = int(np.sum(np.abs(betas[:, column] / ses[:, column]) > critical))
+        lower = stats.beta.ppf(0.025, successes, nsim - successes + 1) if successes else 0.0
+        upper = stats.beta.ppf(0.975, successes + 1, nsim - successes) if successes < nsim else 1.0
+        rows.append((int(k), successes, nsim, successes / nsim, lower, upper))
+    return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,96 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from analysis.glmm import fit_lmm, power_curve
+from benchmarks.synthetic import write_synthetic_corpus
+from imports.import_data import extract_sampling_across_positions, generateDescriptives
+
+# The sensitivity model and power curve of R/glmm.R, on the same data
+R_SCRIPT = """
+suppressMessages({library(lme4); library(simr)})
+data <- read.csv(commandArgs(TRUE)[1])
+data$Position <- factor(data$Position)
+data$Object <- factor(data$Object)
+data$logY_var <- log(data$Duration)
+start <- Sys.time()
+model_lmer <- lmer(logY_var ~ Position * Object + (1 | id), data = data)
+fit_seconds <- as.numeric(difftime(Sys.time(), start, units = "secs"))
+start <- Sys.time()
+pc <- powerCurve(model_lmer, fixed(names(fixef(model_lmer))[4], "t"), nsim = as.integer(commandArgs(TRUE)[2]),
+                 progress = FALSE)
+cat(fit_seconds, as.numeric(difftime(Sys.time(), start, units = "secs")), "\\n")
+"""
+
+
+def run_r(sampling_across_positions, nsim):
+    """
+        Times lmer and simr::powerCurve on the same data, or returns None if
+        Rscript (with lme4 and simr) is not available.
+    """
+    if shutil.which('Rscript') is None:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, 'data.csv')
+        script_path = os.path.join(tmp, 'power.R')
+        sampling_across_positions.to_csv(data_path, index=False)
+        with open(script_path, 'w') as f:
+            f.write(R_SCRIPT)
+        out = subprocess.run(['Rscript', script_path, data_path, str(nsim)], capture_output=True, text=True)
+    if out.returncode:
+        print(out.stderr)
+        return None
+    fit_seconds, power_seconds = map(float, out.stdout.split())
+    return {'fit': fit_seconds, 'power_curve': power_seconds}
+
+
+def run(DIR, nsim=1000, workers=(1, 2, 4)):
+    """
+        Times fit_lmm and power_curve for every number of worker processes,
+        checks that they agree, and compares with R/glmm.R's lmer and powerCurve
+        if R is available.
+    """
+    body, manual = generateDescriptives(DIR)
+    sampling_across_positions = extract_sampling_across_positions(DIR, body, manual)
+
+    start = time.perf_counter()
+    fit = fit_lmm(sampling_across_positions)
+    timings = {'fit': time.perf_counter() - start}
+
+    reference = None
+    for n in workers:
+        start = time.perf_counter()
+        curve = power_curve(fit, nsim=nsim, workers=n)
+        timings[f'power_curve workers={n}'] = time.perf_counter() - start
+        if reference is None:
+            reference = curve
+        assert reference.equals(curve)
+
+    r_timings = run_r(sampling_across_positions, nsim)
+    if r_timings is None:
+        print('Rscript with lme4 and simr not found; R timings skipped.')
+    else:
+        for stage, seconds in r_timings.items():
+            timings[f'R {stage}'] = seconds
+
+    print(f"{len(sampling_across_positions)} episodes, {len(fit['starts'])} participants, nsim={nsim}")
+    for stage, seconds in timings.items():
+        print(f"{stage:30s} {seconds:8.3f} s")
+    print(reference.to_string(index=False))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the Python statistics stage against R/glmm.R.')
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--session-length', type=int, default=600000)
+    parser.add_argument('--nsim', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants, args.session_length)
+        run(DIR, args.nsim, args.workers)
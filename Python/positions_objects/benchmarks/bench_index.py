@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from imports.episode_index import EpisodeIndex
+from imports.import_data import BODY_DTYPES
+
+
+def synthetic_positions(n_participants, episodes_per_participant, tiers=('Sitting', 'Prone', 'Supine', 'Standing'),
+                        seed=0):
+    """
+        A body table of back-to-back position episodes, as generateBodyDescriptives
+        returns it, without writing ELAN files.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_participants * episodes_per_participant
+    duration = rng.integers(1000, 60000, n)
+    start = (np.cumsum(duration).reshape(n_participants, -1) - duration.reshape(n_participants, -1)).ravel()
+    return pd.DataFrame({'StartTime': start, 'EndTime': start + duration, 'Duration': duration,
+                         'Tier': rng.choice(list(tiers), n), 'id': np.repeat(np.arange(n_participants) + 10001,
+                                                                             episodes_per_participant),
+                         'TimePoint': '3'}).astype(BODY_DTYPES)
+
+
+def run(n_participants, episodes_per_participant, queries=1000, seed=0):
+    """
+        Times single "episodes of id X on tier T overlapping [t0, t1)" queries
+        through an EpisodeIndex and through boolean masks over the whole table.
+    """
+    body = synthetic_positions(n_participants, episodes_per_participant, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    ids = rng.integers(10001, 10001 + n_participants, queries)
+    tiers = rng.choice(['Sitting', 'Prone', 'Supine', 'Standing'], queries)
+    t0 = rng.integers(0, int(body['EndTime'].max()), queries)
+    t1 = t0 + 30000
+
+    start = time.perf_counter()
+    index = EpisodeIndex(body)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = [len(index.overlapping(i, t, a, b)) for i, t, a, b in zip(ids, tiers, t0, t1)]
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [int(((body['id'] == i) & (body['Tier'] == t) & (body['StartTime'] < b) & (body['EndTime'] > a)).sum())
+                for i, t, a, b in zip(ids, tiers, t0, t1)]
+    scanned = time.perf_counter() - start
+    assert found == expected
+
+    start = time.perf_counter()
+    index.search(index.groups(ids, tiers), t0, t1)
+    batched = time.perf_counter() - start
+
+    print(f"{len(body)} episodes, {queries} queries: build {build * 1000:.1f} ms, "
+          f"indexed {indexed / queries * 1e6:.1f} us/query, batched {batched / queries * 1e6:.2f} us/query, "
+          f"scan {scanned / queries * 1e6:.1f} us/query")
+    return {'build': build, 'indexed': indexed, 'batched': batched, 'scan': scanned}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare EpisodeIndex queries with table scans.')
+    parser.add_argument('--participants', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--episodes', type=int, default=100, help='Position episodes per participant.')
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    for n in args.participants:
+        run(n, args.episodes, args.queries)
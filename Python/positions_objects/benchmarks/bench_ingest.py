@@ -0,0 +1,41 @@
+import argparse
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_corpus
+from imports.import_data import generateBodyDescriptives, generateManualDescriptives, generateDescriptives
+
+
+def run(DIR, repeat=3):
+    """
+        Times the two-call ingestion (generateBodyDescriptives followed by
+        generateManualDescriptives) against the single-pass generateDescriptives
+        and checks that both paths return the same tables.
+    """
+    two_call, single_pass = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = generateBodyDescriptives(DIR)
+        manual = generateManualDescriptives(DIR)
+        two_call.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        body_sp, manual_sp = generateDescriptives(DIR)
+        single_pass.append(time.perf_counter() - start)
+
+    assert body.equals(body_sp) and manual.equals(manual_sp)
+
+    print(f"two-call:    {min(two_call):.3f} s")
+    print(f"single-pass: {min(single_pass):.3f} s ({min(two_call) / min(single_pass):.2f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark single-pass EAF ingestion.')
+    parser.add_argument('--participants', type=int, default=20)
+    parser.add_argument('--session-length', type=int, default=600000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants, args.session_length)
+        run(DIR, args.repeat)
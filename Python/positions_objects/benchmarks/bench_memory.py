@@ -0,0 +1,38 @@
+import argparse
+import tempfile
+
+from benchmarks.synthetic import write_synthetic_corpus
+from imports.import_data import generateDescriptives
+
+
+def _legacy(df):
+    """
+        The former layout of the same table: every column an object column and the
+        id kept as the '<id>_T' string taken from the file name.
+    """
+    df = df.astype(object)
+    df['id'] = df['id'].astype(str) + '_' + df['TimePoint'].astype(str)
+    return df
+
+
+def run(DIR):
+    """
+        Reports the memory of the body and manual tables per million annotations in
+        the former object layout and in the compact typed layout.
+    """
+    body, manual = generateDescriptives(DIR)
+    for name, df in [('body', body), ('manual', manual)]:
+        before = _legacy(df).memory_usage(deep=True).sum() / len(df) * 1e6
+        after = df.memory_usage(deep=True).sum() / len(df) * 1e6
+        print(f"{name}: {before / 2 ** 20:.1f} MiB -> {after / 2 ** 20:.1f} MiB per million annotations "
+              f"({before / after:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report memory per million annotations.')
+    parser.add_argument('--participants', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants)
+        run(DIR)
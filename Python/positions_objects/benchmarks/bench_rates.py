@@ -0,0 +1,99 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from imports.binned_rates import binned_rates, _position_labels
+from imports.import_data import BODY_DTYPES
+
+
+def synthetic_positions(n_participants, session_length, seed=0):
+    """
+        A body table of back-to-back position episodes filling every session.
+    """
+    rng = np.random.default_rng(seed)
+    per_participant = session_length // 1000
+    duration = rng.integers(1000, 60000, (n_participants, per_participant))
+    start = np.cumsum(duration, axis=1) - duration
+    keep = (start < session_length).ravel()
+    start, duration = start.ravel()[keep], duration.ravel()[keep]
+    end = np.minimum(start + duration, session_length)
+    return pd.DataFrame({'StartTime': start, 'EndTime': end, 'Duration': end - start,
+                         'Tier': rng.choice(['Sitting', 'Prone', 'Supine', 'Standing'], len(start)),
+                         'id': np.repeat(np.arange(n_participants) + 10001, per_participant)[keep],
+                         'TimePoint': '3'}).astype(BODY_DTYPES)
+
+
+def synthetic_sampling(body, episodes_per_participant, seed=0):
+    """
+        Sampling episodes as extract_sampling_across_positions returns them, drawn
+        within the sessions of body, without clipping them to the positions.
+    """
+    rng = np.random.default_rng(seed)
+    end = body.groupby('id')['EndTime'].max()
+    ids = np.repeat(end.index.to_numpy(), episodes_per_participant)
+    start = (rng.random(len(ids)) * (np.repeat(end.to_numpy(), episodes_per_participant) - 20000)).astype(np.int64)
+    stop = start + rng.integers(100, 20000, len(ids))
+    return pd.DataFrame({'StartTime': start, 'EndTime': stop, 'Duration': (stop - start) / 1000,
+                         'Tier': 'inhand_left_child', 'id': ids,
+                         'Object': pd.Categorical(rng.choice(['graspable', 'stationary'], len(ids))),
+                         'Position': pd.Categorical(rng.choice(['Independent sitting', 'Other'], len(ids)))})
+
+
+def per_episode_bins(sampling, body, bin_size):
+    """
+        The straightforward alternative: every episode is expanded into one row per
+        bin it spans and the overlaps are summed with groupby.
+    """
+    body, position = _position_labels(body)
+    tables = []
+    for df, labels in [(sampling, ['Object', 'Position']), (body.assign(Position=position.to_numpy()), ['Position'])]:
+        first = df['StartTime'].to_numpy() // bin_size
+        last = (df['EndTime'].to_numpy() - 1) // bin_size
+        rows = np.repeat(np.arange(len(df)), last - first + 1)
+        binned = df.iloc[rows][['id', 'StartTime', 'EndTime'] + labels].reset_index(drop=True)
+        binned['bin'] = first[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(last - first + 1) - (last - first + 1),
+                                                                       last - first + 1)
+        lo = binned['bin'] * bin_size
+        binned['overlap'] = np.minimum(binned['EndTime'], lo + bin_size) - np.maximum(binned['StartTime'], lo)
+        tables.append(binned.groupby(['id', 'bin'] + labels, observed=True)['overlap'].sum())
+    return tables
+
+
+def run(n_participants, episodes_per_participant, bin_size, session_length=1800000, seed=0):
+    """
+        Times binned_rates against per_episode_bins on synthetic sessions.
+    """
+    body = synthetic_positions(n_participants, session_length, seed=seed)
+    sampling = synthetic_sampling(body, episodes_per_participant, seed)
+
+    results = {}
+    for name, func in [('bincount', binned_rates), ('expanded', per_episode_bins)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        out = func(sampling, body, bin_size)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {'seconds': seconds, 'peak_bytes': peak}
+        if name == 'bincount':
+            rows = len(out)
+
+    print(f"{n_participants} participants, {len(sampling)} episodes, {bin_size / 1000:g} s bins ({rows} rows): "
+          + ', '.join(f"{name} {r['seconds'] * 1000:.1f} ms / {r['peak_bytes'] / 2 ** 20:.1f} MiB"
+                      for name, r in results.items()))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare binned_rates with expanding episodes into their bins.')
+    parser.add_argument('--participants', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--episodes', type=int, default=200, help='Sampling episodes per participant.')
+    parser.add_argument('--bin-sizes', type=int, nargs='+', default=[1000, 10000, 60000], help='Bin sizes (ms).')
+    args = parser.parse_args()
+
+    for n in args.participants:
+        for bin_size in args.bin_sizes:
+            run(n, args.episodes, bin_size)
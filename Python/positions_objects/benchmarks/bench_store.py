@@ -0,0 +1,64 @@
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import write_synthetic_corpus
+from imports import column_store
+from imports.import_data import generateDescriptives, read_length, MANUAL_DTYPES, _as_schema
+
+
+def _best(func, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func()
+        runs.append(time.perf_counter() - start)
+    return min(runs), out
+
+
+def run(DIR, repeat=3):
+    """
+        Times reloading the manual table and the session lengths from csv/Excel
+        and from the column store: the whole table, one participant and one column.
+    """
+    _, manual = generateDescriptives(DIR)
+    csv_path = os.path.join(DIR, 'manual.csv')
+    manual.to_csv(csv_path)
+    store_dir = os.path.join(DIR, 'store')
+    column_store.write_table(manual, store_dir, 'manual')
+    read_length(DIR, store_dir)
+    participant = int(manual['id'].iloc[-1])
+
+    timings = {}
+    timings['manual csv'], from_csv = _best(
+        lambda: _as_schema(pd.read_csv(csv_path, index_col=0), MANUAL_DTYPES), repeat)
+    timings['manual store'], from_store = _best(lambda: column_store.read_table(store_dir, 'manual'), repeat)
+    assert from_csv.equals(from_store)
+    timings['manual store, one id'], _ = _best(
+        lambda: column_store.read_table(store_dir, 'manual', ids=[participant]), repeat)
+    timings['manual store, one column'], _ = _best(
+        lambda: column_store.read_column(store_dir, 'manual', 'Duration').sum(), repeat)
+    timings['length xlsx'], _ = _best(lambda: read_length(DIR), repeat)
+    timings['length store'], _ = _best(lambda: read_length(DIR, store_dir), repeat)
+
+    print(f"{len(manual)} manual annotations, {manual['id'].nunique()} participants")
+    for stage, seconds in timings.items():
+        print(f"{stage:28s} {seconds * 1000:9.2f} ms")
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare reloading tables from csv/Excel and the column store.')
+    parser.add_argument('--participants', type=int, default=200)
+    parser.add_argument('--session-length', type=int, default=1800000)
+    parser.add_argument('--density', type=float, default=4.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants, args.session_length, density=args.density,
+                               write_length=True)
+        run(DIR, args.repeat)
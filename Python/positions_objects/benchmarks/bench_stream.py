@@ -0,0 +1,43 @@
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import write_synthetic_corpus
+from imports.import_data import generateDescriptives
+
+
+def _measure(DIR, backend):
+    tracemalloc.start()
+    start = time.perf_counter()
+    body, manual = generateDescriptives(DIR, backend=backend)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, manual, seconds, peak
+
+
+def run(DIR):
+    """
+        Compares time and peak traced memory of ingesting the directory with the
+        pympi backend and with the streaming backend, and checks both return the
+        same tables.
+    """
+    body, manual, pympi_time, pympi_peak = _measure(DIR, 'pympi')
+    body_st, manual_st, stream_time, stream_peak = _measure(DIR, 'stream')
+    assert body.equals(body_st) and manual.equals(manual_st)
+
+    print(f"pympi:  {pympi_time:.3f} s, peak {pympi_peak / 2 ** 20:.1f} MiB")
+    print(f"stream: {stream_time:.3f} s, peak {stream_peak / 2 ** 20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the streaming EAF reader against pympi.')
+    parser.add_argument('--participants', type=int, default=2)
+    parser.add_argument('--hours', type=float, default=8)
+    parser.add_argument('--extra-tiers', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants, int(args.hours * 3600000), n_extra_tiers=args.extra_tiers)
+        run(DIR)
@@ -0,0 +1,41 @@
+import argparse
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_corpus
+from imports.import_data import generateDescriptives
+
+
+def run(DIR, workers=(1, 2, 4, 8), repeat=3):
+    """
+        Times generateDescriptives on the same directory for every number of
+        worker processes and checks that all of them return the serial result.
+    """
+    body, manual = generateDescriptives(DIR)
+    timings = {}
+    for n in workers:
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body_n, manual_n = generateDescriptives(DIR, workers=n)
+            runs.append(time.perf_counter() - start)
+        assert body.equals(body_n) and manual.equals(manual_n)
+        timings[n] = min(runs)
+
+    for n, seconds in timings.items():
+        print(f"workers={n}: {seconds:.3f} s ({timings[workers[0]] / seconds:.2f}x)")
+
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure scaling of parallel EAF ingestion.')
+    parser.add_argument('--participants', type=int, default=200)
+    parser.add_argument('--session-length', type=int, default=1800000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants, args.session_length)
+        run(DIR, args.workers, args.repeat)
@@ -0,0 +1,120 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from benchmarks.synthetic import write_synthetic_corpus
+from imports.import_data import calculate_sampling_across_positions, extract_sampling_across_positions, \
+    extract_sampling_per_id, generateBodyDescriptives, generateManualDescriptives
+from plotting.plot_data import make_boxplots_interaction, make_boxplots_interaction_count
+
+
+def _measure(stage, results, func, *args, **kwargs):
+    """
+        Runs func once, recording its wall time and peak traced memory under the
+        name stage in results, and returns its output.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    plt.close('all')
+    results[stage] = {'seconds': seconds, 'peak_bytes': peak}
+    return out
+
+
+def run(DIR):
+    """
+        Times every stage of the pipeline on the corpus in DIR, as main.py runs them.
+
+        Returns:
+        dict: stage name -> {'seconds', 'peak_bytes'}, in pipeline order.
+    """
+    results = {}
+    body = _measure('generateBodyDescriptives', results, generateBodyDescriptives, DIR)
+    manual = _measure('generateManualDescriptives', results, generateManualDescriptives, DIR)
+
+    all_positions = [x for x in body['Tier'].unique() if x not in ["Claps", 'Undefined']]
+    _measure('calculate_sampling_across_positions', results, calculate_sampling_across_positions,
+             manual, body, all_positions, ['bubbles', 'dino', 'klickity', 'spinner'])
+    sampling_across_positions = _measure('extract_sampling_across_positions', results,
+                                         extract_sampling_across_positions, DIR, body, manual)
+    sampling_per_id = _measure('extract_sampling_per_id', results,
+                               extract_sampling_per_id, DIR, sampling_across_positions)
+    sampling_per_id = sampling_per_id[sampling_per_id['count'] > 0].reset_index(drop=True)
+
+    df_sit = sampling_across_positions[sampling_across_positions['Position'] == 'Independent sitting']
+    df_non = sampling_across_positions[sampling_across_positions['Position'] == 'Other']
+    df_sit_mdn = df_sit.groupby(['id', 'Object', 'Position'], observed=True)['Duration'].median().reset_index(drop=False)
+    df_non_mdn = df_non.groupby(['id', 'Object', 'Position'], observed=True)['Duration'].median().reset_index(drop=False)
+
+    icon = np.zeros((32, 32, 3))
+    plot_args = dict(toys=['graspable', 'stationary'],
+                     colors={"graspable": "#2bc3db", "stationary": "#bfd739"},
+                     toy_images={'graspable': {'dino_img': icon, 'bubbles_img': icon},
+                                 'stationary': {'klickity_img': icon, 'spinner_img': icon}},
+                     fig_size=(10, 10))
+    _measure('make_boxplots_interaction', results, make_boxplots_interaction,
+             df_sit_mdn, df_non_mdn, y_var='Duration', **plot_args)
+    _measure('make_boxplots_interaction_count', results, make_boxplots_interaction_count,
+             sampling_per_id[sampling_per_id['Position'] == 'Independent sitting'],
+             sampling_per_id[sampling_per_id['Position'] == 'Other'], y_var='count_per_min', **plot_args)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+        Returns the stages that are more than tolerance (a fraction) slower than
+        in the baseline report.
+    """
+    slower = []
+    for stage, result in results.items():
+        reference = baseline['stages'].get(stage)
+        if reference is not None and result['seconds'] > reference['seconds'] * (1 + tolerance):
+            slower.append(stage)
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on a synthetic EAF corpus.')
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--session-length', type=int, default=600000)
+    parser.add_argument('--density', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Earlier report to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as DIR:
+        write_synthetic_corpus(DIR, args.participants, args.session_length, seed=args.seed,
+                               density=args.density, write_length=True)
+        results = run(DIR)
+
+    report = {'corpus': {'participants': args.participants, 'session_length': args.session_length,
+                         'density': args.density, 'seed': args.seed},
+              'python': platform.python_version(),
+              'stages': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for stage, result in results.items():
+        print(f"{stage:40s} {result['seconds']:8.3f} s {result['peak_bytes'] / 2 ** 20:8.1f} MiB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        if slower:
+            print(f"Slower than baseline: {', '.join(slower)}")
+            sys.exit(1)
@@ -0,0 +1,72 @@
+import os
+import random
+
+import pandas as pd
+import pympi
+
+POSITION_TIERS = ['Sitting', 'Prone', 'Supine', 'Standing', 'Undefined']
+INHAND_TIERS = ['inhand_left_child', 'inhand_right_child']
+TOYS = ['bubbles', 'dino', 'klickity', 'spinner']
+
+
+def write_synthetic_corpus(out_dir, n_participants=20, session_length=600000, seed=0, n_extra_tiers=0,
+                           density=1.0, position_tiers=POSITION_TIERS, inhand_tiers=INHAND_TIERS, toys=TOYS,
+                           write_length=False):
+    """
+        Writes synthetic ELAN (.eaf) files shaped like the coded sessions: one
+        position tier per body position with empty-valued episodes, in-hand tiers
+        labelled with toys (and an unanalysed 'other' label) and a 'Claps' tier
+        used for synchronisation.
+
+        Parameters:
+        out_dir (str): Directory the files are written to (created if missing).
+        n_participants (int): Number of files, named <id>_T3.eaf.
+        session_length (int): Length of every session in milliseconds.
+        seed (int): Seed of the random generator, so corpora are reproducible.
+        n_extra_tiers (int): Additional labelled tiers (e.g. caregiver coding) that
+                             the analysis reads past.
+        density (float): Relative annotation density; 2 halves the length of the
+                         in-hand episodes and of the gaps between them.
+        position_tiers (list): Names of the position tiers.
+        inhand_tiers (list): Names of the in-hand tiers.
+        toys (list): Object labels used on the in-hand tiers.
+        write_length (bool): Also write length_T3.xlsx with the session lengths,
+                             as read by extract_sampling_per_id.
+
+        Returns:
+        list: Paths of the written files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for participant in range(n_participants):
+        eaf = pympi.Elan.Eaf()
+        extra_tiers = [f'extra_{i}' for i in range(n_extra_tiers)]
+        for tier in position_tiers + inhand_tiers + extra_tiers + ['Claps']:
+            eaf.add_tier(tier)
+
+        t = 0
+        while t < session_length:
+            duration = rng.randint(1000, 60000)
+            eaf.add_annotation(rng.choice(position_tiers), t, min(t + duration, session_length))
+            t += duration + rng.randint(0, 2000)
+
+        for tier in inhand_tiers + extra_tiers:
+            t = rng.randint(0, 3000)
+            while t < session_length:
+                duration = max(1, int(rng.randint(100, 20000) / density))
+                eaf.add_annotation(tier, t, min(t + duration, session_length), rng.choice(toys + ['other']))
+                t += duration + max(1, int(rng.randint(1, 5000) / density))
+
+        eaf.add_annotation('Claps', 0, 500)
+
+        path = os.path.join(out_dir, f'{10001 + participant}_T3.eaf')
+        eaf.to_file(path)
+        paths.append(path)
+
+    if write_length:
+        length = pd.DataFrame({'id': [10001 + participant for participant in range(n_participants)],
+                               'video_length': session_length})
+        length.to_excel(os.path.join(out_dir, 'length_T3.xlsx'), index=False)
+
+    return paths
@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from imports import column_store
+from imports.import_data import _as_schema, _relabel, read_length, BODY_DTYPES, MIN_POSITION_DURATION, NON_POSITION_TIERS, \
+    OTHER_POSITION, POSITION_SPLIT
+from profiling import profiler
+
+# Bin sizes (ms) of the rates written by main.py.
+BIN_SIZES = [10000, 60000]
+
+
+def _covered_time(start_bin, end_bin, code, starts, ends, bin_start, n_bins, n_categories, bin_size):
+    """
+        Time covered by the intervals [starts, ends) in every bin and category,
+        with np.bincount over the interval boundaries only: the covered time up
+        to t is sum(slope * (t - boundary)) over the boundaries before t, the
+        slope being +1 at a start and -1 at an end. So the slope entering a bin
+        covers all of it, and each boundary within the bin covers (or uncovers)
+        the rest of the bin after it. The bins of every participant must be
+        consecutive.
+
+        Parameters:
+        start_bin, end_bin (ndarray): Flat bin of every start and end.
+        code (ndarray): Category of every interval.
+        starts, ends (ndarray): The intervals (ms).
+        bin_start (ndarray): Start time of every flat bin.
+
+        Returns:
+        ndarray: (n_bins, n_categories) covered time in ms.
+    """
+    n_cells = n_bins * n_categories
+    start_cell = start_bin * n_categories + code
+    end_cell = end_bin * n_categories + code
+    covered = np.bincount(start_cell, minlength=n_cells) - np.bincount(end_cell, minlength=n_cells)
+    covered = np.cumsum(covered.reshape(n_bins, n_categories), axis=0)
+    covered *= bin_size
+    moment = np.bincount(end_cell, weights=ends - bin_start[end_bin], minlength=n_cells)
+    moment -= np.bincount(start_cell, weights=starts - bin_start[start_bin], minlength=n_cells)
+    moment = moment.reshape(n_bins, n_categories)
+    moment += covered
+    return moment
+
+
+def _position_labels(body, position_split=POSITION_SPLIT, min_duration=MIN_POSITION_DURATION):
+    body = body[~body['Tier'].isin(NON_POSITION_TIERS) & (body['Duration'] > min_duration)]
+    return body, _relabel(body['Tier'], lambda x: position_split.get(x, OTHER_POSITION))
+
+
+def _codes(values, categories):
+    """
+        Codes of values in categories (-1 if missing), looking up every distinct
+        label once.
+    """
+    values = values.astype('category')
+    lookup = pd.Index(categories).get_indexer(values.cat.categories.astype(str))
+    return np.append(lookup, -1)[values.cat.codes.to_numpy()]
+
+
+@profiler.stage('binned_rates')
+def binned_rates(sampling_across_positions, body, bin_size=60000, length=None, aff_label='Object', con_position='Position'):
+    """
+        Time-resolved sampling rates: the number of sampling episodes starting in
+        every bin of bin_size ms, per id, object and position, divided by the time
+        spent in that position during the bin (instead of the whole video length,
+        as count_per_min of extract_sampling_per_id).
+
+        All participants are binned in one pass: every bin of every participant
+        and category is a slot of a flat array, the episode counts are a
+        np.bincount of the onsets, and the time in position and the sampling time
+        per bin are accumulated with np.bincount over the episode boundaries
+        (see _covered_time). No episode is split into the bins it spans, so
+        beyond the input tables memory grows with the number of bins and not with
+        episodes x bins.
+
+        Parameters:
+        sampling_across_positions (pd.DataFrame): Output of extract_sampling_across_positions.
+        body (pd.DataFrame): Output of generateBodyDescriptives; the positions are
+                             filtered and split as in extract_sampling_across_positions.
+        bin_size (int): Bin size in ms; None for a single bin per session.
+        length (pd.DataFrame): Optional session lengths (id, video_length in ms),
+                               extending the bins to the end of the video.
+
+        Returns:
+        pd.DataFrame: One row per id, bin, position and object with the bin start
+                      'BinStart' (ms), 'count', the sampling time 'Duration' and
+                      the time in position 'position_time' (both in s), and
+                      'count_per_min' (count per minute in position). Bins
+                      without time in a position are left out for that position.
+    """
+    body = _as_schema(body, BODY_DTYPES)
+    body, position = _position_labels(body)
+    sampling = sampling_across_positions[sampling_across_positions['id'].isin(body['id'].unique())]
+
+    ids = np.unique(np.concatenate([sampling['id'].to_numpy(), body['id'].to_numpy()]))
+    end = pd.concat([sampling.groupby('id', observed=True)['EndTime'].max(),
+                     body.groupby('id', observed=True)['EndTime'].max()]).groupby(level=0).max()
+    if length is not None:
+        end = pd.concat([end, length.set_index('id')['video_length']]).groupby(level=0).max()
+    end = end.reindex(ids).to_numpy(np.int64)
+    if bin_size is None:
+        bin_size = int(end.max(initial=0)) + 1
+
+    # Bins of every participant are consecutive on one flat axis; an end time
+    # falling exactly on the end of the last bin stays in that bin.
+    n_bins_id = np.maximum((end + bin_size - 1) // bin_size, 1)
+    first_bin = np.cumsum(n_bins_id) - n_bins_id
+    n_bins = int(n_bins_id.sum())
+    bin_id = np.repeat(ids, n_bins_id)
+    bin_start = (np.arange(n_bins) - np.repeat(first_bin, n_bins_id)) * bin_size
+
+    def flat_bin(id_values, times):
+        row = np.searchsorted(ids, id_values)
+        local = np.minimum(np.asarray(times, dtype=np.int64) // bin_size, n_bins_id[row] - 1)
+        return first_bin[row] + np.maximum(local, 0)
+
+    def boundaries(df):
+        id_values = df['id'].to_numpy(np.int64)
+        starts = df['StartTime'].to_numpy(np.int64)
+        ends = df['EndTime'].to_numpy(np.int64)
+        # The end is attributed to the bin holding its last covered instant.
+        return flat_bin(id_values, starts), flat_bin(id_values, np.maximum(ends - 1, starts)), starts, ends
+
+    positions = list(position.cat.categories)
+    objects = sorted(sampling[aff_label].astype('category').cat.remove_unused_categories().cat.categories.astype(str))
+    start_bin, end_bin, starts, ends = boundaries(body)
+    position_time = _covered_time(start_bin, end_bin, position.cat.codes.to_numpy().astype(np.int64), starts, ends,
+                                  bin_start, n_bins, len(positions), bin_size)
+
+    # Sampling categories are numbered position-major, as position * len(objects) + object.
+    object_code = _codes(sampling[aff_label], objects)
+    position_code = _codes(sampling[con_position], positions)
+    # Episodes in a position without time in body (e.g. filtered out) are left out.
+    known = (object_code >= 0) & (position_code >= 0)
+    sampling = sampling[known]
+    code = position_code[known] * len(objects) + object_code[known]
+    start_bin, end_bin, starts, ends = boundaries(sampling)
+    n_categories = len(positions) * len(objects)
+    counts = np.bincount(start_bin * n_categories + code, minlength=n_bins * n_categories)
+    duration = _covered_time(start_bin, end_bin, code, starts, ends, bin_start, n_bins, n_categories, bin_size)
+
+    # Every (position, object) cell is divided by the time in its position; bins
+    # without time in a position have no rate and are left out for it.
+    position_cell = np.flatnonzero(position_time.ravel() > 0)
+    cell = (position_cell[:, None] * len(objects) + np.arange(len(objects))).ravel()
+    bin_index, category = np.divmod(cell, n_categories)
+
+    rates = pd.DataFrame({
+        'id': bin_id[bin_index].astype(np.int32),
+        'bin': (bin_start[bin_index] // bin_size).astype(np.int32),
+        'BinStart': bin_start[bin_index],
+        aff_label: pd.Categorical.from_codes(category % len(objects), categories=objects),
+        con_position: pd.Categorical.from_codes(category // len(objects), categories=positions),
+        'count': counts[cell].astype(np.int32),
+        'Duration': duration.ravel()[cell] / 1000,
+        'position_time': np.repeat(position_time.ravel()[position_cell], len(objects)) / 1000,
+    })
+    rates['count_per_min'] = rates['count'] / (rates['position_time'] / 60)
+    return rates
+
+
+@profiler.stage('extract_binned_rates')
+def extract_binned_rates(DIR, sampling_across_positions, body, bin_size=60000, store_dir=None):
+    """
+        binned_rates over the session lengths of length_T3.xlsx in DIR (if present).
+    """
+    has_length = column_store.has_table(store_dir, 'length') or os.path.exists(DIR + '/length_T3.xlsx')
+    length = read_length(DIR, store_dir) if has_length else None
+    return binned_rates(sampling_across_positions, body, bin_size, length)
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the on-disk layout changes; tables of other versions are treated as missing.
+STORE_VERSION = 2
+TABLES = ['body', 'manual', 'length', 'sampling_across_positions', 'sampling_per_id', 'rates_10s', 'rates_60s']
+
+
+def _table_dir(store_dir, name):
+    return os.path.join(store_dir, name)
+
+
+def _meta_path(store_dir, name):
+    return os.path.join(_table_dir(store_dir, name), 'meta.json')
+
+
+def _column_path(table_dir, i):
+    return os.path.join(table_dir, f'{i}.npy')
+
+
+def _source_signature(source):
+    stat = os.stat(source)
+    return {'path': os.path.abspath(source), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def write_table(df, store_dir, name, id_column='id', source=None):
+    """
+        Stores a table as one .npy file per column, plus meta.json with the column
+        types, the categories and the row range of every id. Rows are kept in
+        their order if the rows of every id are contiguous (as in all tables of
+        the pipeline). Otherwise they are stored stably sorted by id, so that
+        every id still has one row range, along with the position of every row
+        in the sorted order; read_table restores the original order when
+        loading the whole table. df.attrs (which must be JSON serialisable) are
+        kept and restored by read_table. The table is written to a temporary
+        directory first and then moved into place.
+
+        Parameters:
+        df (pd.DataFrame): Table with integer, float, bool, categorical or string columns.
+        store_dir (str): Directory of the store (created if missing).
+        name (str): Name of the table, e.g. one of TABLES.
+        id_column (str): Column the row ranges are built on.
+        source (str): Optional file the table was read from; read_table then
+                      treats the table as missing once that file changes.
+    """
+    ids = df[id_column].to_numpy()
+    run_starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=int)
+    order = None
+    if len(np.unique(ids[run_starts])) != len(run_starts):
+        order = np.argsort(ids, kind='stable')
+        df = df.iloc[order]
+        ids = df[id_column].to_numpy()
+        run_starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+
+    table_dir = _table_dir(store_dir, name)
+    tmp = f'{table_dir}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            meta = {'name': column, 'kind': 'category', 'categories': values.cat.categories.astype(str).tolist()}
+            data = values.cat.codes.to_numpy()
+        elif pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype):
+            categorical = pd.Categorical(values)
+            meta = {'name': column, 'kind': 'string', 'categories': categorical.categories.astype(str).tolist()}
+            data = categorical.codes
+        else:
+            meta = {'name': column, 'kind': 'numeric'}
+            data = values.to_numpy()
+        np.save(_column_path(tmp, i), np.ascontiguousarray(data), allow_pickle=False)
+        columns.append(meta)
+    np.save(_column_path(tmp, 'index'), df.index.to_numpy(np.int64), allow_pickle=False)
+    if order is not None:
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        np.save(_column_path(tmp, 'positions'), positions, allow_pickle=False)
+
+    meta = {'version': STORE_VERSION, 'n_rows': len(df), 'id_column': id_column, 'columns': columns,
+            'ids': ids[run_starts].tolist(), 'offsets': run_starts.tolist() + [len(df)],
+            'source': _source_signature(source) if source is not None else None, 'attrs': df.attrs,
+            'sorted': order is not None}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.replace(tmp, table_dir)
+
+
+def _read_meta(store_dir, name):
+    try:
+        with open(_meta_path(store_dir, name)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != STORE_VERSION:
+        return None
+    source = meta.get('source')
+    if source is not None:
+        try:
+            if _source_signature(source['path']) != source:
+                return None
+        except OSError:
+            return None
+    return meta
+
+
+def has_table(store_dir, name):
+    """
+        Whether the store holds an up-to-date table of that name.
+    """
+    return store_dir is not None and _read_meta(store_dir, name) is not None
+
+
+def id_ranges(store_dir, name):
+    """
+        Returns {id: (start, stop)}, the rows of every id in the table.
+    """
+    meta = _read_meta(store_dir, name)
+    return {id_: (start, stop) for id_, start, stop in zip(meta['ids'], meta['offsets'][:-1], meta['offsets'][1:])}
+
+
+def _rows(meta, ids):
+    if ids is None:
+        return [(0, meta['n_rows'])]
+    ranges = dict(zip(meta['ids'], zip(meta['offsets'][:-1], meta['offsets'][1:])))
+    return [ranges[id_] for id_ in ids if id_ in ranges]
+
+
+def read_column(store_dir, name, column, id=None):
+    """
+        Returns a column as a read-only memory-mapped array, without reading the
+        file; with id, only the rows of that participant. Categorical and string
+        columns are returned as their integer codes. Rows are in stored order,
+        i.e. sorted by id if the table was written with non-contiguous ids.
+    """
+    meta = _read_meta(store_dir, name)
+    i = [c['name'] for c in meta['columns']].index(column)
+    values = np.load(_column_path(_table_dir(store_dir, name), i), mmap_mode='r')
+    if id is None:
+        return values
+    rows = _rows(meta, [id])
+    return values[rows[0][0]:rows[0][1]] if rows else values[:0]
+
+
+def read_table(store_dir, name, ids=None, columns=None):
+    """
+        Loads a table, or the rows of some participants and/or some columns of
+        it. Only the requested row ranges of the memory-mapped column files are
+        read.
+
+        Parameters:
+        store_dir (str): Directory of the store.
+        name (str): Name of the table.
+        ids (list): Participant ids to load, in this order; all rows, in the
+                    order they were written, if None.
+        columns (list): Columns to load; all if None.
+
+        Returns:
+        pd.DataFrame: The table with its original index, column types and attrs.
+    """
+    meta = _read_meta(store_dir, name)
+    if meta is None:
+        raise FileNotFoundError(f'No table {name!r} in {store_dir}')
+    table_dir = _table_dir(store_dir, name)
+    rows = _rows(meta, ids)
+
+    def load(path):
+        values = np.load(path, mmap_mode='r')
+        if len(rows) == 1:
+            return np.asarray(values[rows[0][0]:rows[0][1]])
+        return np.concatenate([values[start:stop] for start, stop in rows]) if rows else values[:0]
+
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        if columns is not None and column['name'] not in columns:
+            continue
+        values = load(_column_path(table_dir, i))
+        if column['kind'] == 'numeric':
+            data[column['name']] = values
+        else:
+            categorical = pd.Categorical.from_codes(values, column['categories'])
+            data[column['name']] = categorical if column['kind'] == 'category' else np.asarray(categorical, dtype=object)
+    index = pd.Index(load(_column_path(table_dir, 'index')))
+    df = pd.DataFrame(data, index=index, columns=list(data))
+    if ids is None and meta.get('sorted'):
+        df = df.iloc[np.load(_column_path(table_dir, 'positions'))]
+    df.attrs = meta.get('attrs') or {}
+    return df
+
+
+def remove_table(store_dir, name):
+    shutil.rmtree(_table_dir(store_dir, name), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect a column store of the pipeline tables.')
+    parser.add_argument('store_dir')
+    args = parser.parse_args()
+
+    for name in sorted(os.listdir(args.store_dir)):
+        meta = _read_meta(args.store_dir, name)
+        if meta is not None:
+            print(f"{name}: {meta['n_rows']} rows, {len(meta['ids'])} ids, "
+                  f"columns {', '.join(c['name'] for c in meta['columns'])}")
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from imports.import_data import LIMB_TIERS, MIN_POSITION_DURATION, NON_POSITION_TIERS, OTHER_POSITION, \
+    POSITION_SPLIT, TOY_CATEGORIES
+from profiling import profiler
+
+
+def sampling_dimensions(body, limbs=LIMB_TIERS, toy_categories=TOY_CATEGORIES, position_split=POSITION_SPLIT,
+                        min_duration=MIN_POSITION_DURATION):
+    """
+        Dimensions of joint_state_timeline for the sampling analysis of
+        extract_sampling_across_positions: the object category in every hand and
+        the position split, over the position tiers of body.
+
+        Returns:
+        dict: One dimension per limb (named after the tier) and 'Position'.
+    """
+    positions = sorted(x for x in body['Tier'].unique() if x not in NON_POSITION_TIERS)
+    dimensions = {limb: {'tiers': [limb], 'label': 'Object', 'mapping': toy_categories} for limb in limbs}
+    dimensions['Position'] = {'tiers': positions, 'min_duration': min_duration,
+                              'mapping': lambda x: position_split.get(x, OTHER_POSITION)}
+    return dimensions
+
+
+def _dimension_rows(annotations, spec):
+    """
+        The annotations of one dimension, with their state label: the value of
+        spec['label'] (e.g. 'Object') or the tier name, filtered and mapped as
+        configured.
+    """
+    label = spec.get('label')
+    frames = [df for df in annotations if label is None or label in df.columns]
+    rows = pd.concat([df.loc[df['Tier'].isin(spec['tiers']), ['id', 'Tier', 'StartTime', 'EndTime']
+                             + ([label] if label else [])] for df in frames], ignore_index=True)
+    rows['Tier'] = rows['Tier'].astype(str)
+    state = rows[label].astype(str) if label else rows['Tier']
+    keep = (rows['EndTime'] - rows['StartTime']) > spec.get('min_duration', 0)
+    if spec.get('values') is not None:
+        keep &= state.isin(spec['values'])
+    if spec.get('mapping') is not None:
+        state = state.map(spec['mapping'])
+        keep &= state.notna()
+    return rows[keep.to_numpy()], state[keep.to_numpy()]
+
+
+def _latest_active(end_key, candidate, t):
+    """
+        For every query, the last episode at or before candidate whose end key is
+        after t (-1 if none), i.e. the most recently started episode still lasting
+        at t when candidate is the last one started by t. The episodes ending
+        before t are skipped by binary lifting over the running maxima of end_key
+        over blocks of 2**k consecutive episodes, so an episode nested in a longer
+        one does not hide it once it ends.
+
+        Parameters:
+        end_key (ndarray): End keys of the episodes, sorted by start key.
+        candidate (ndarray): Last episode started by every query (-1 if none).
+        t (ndarray): Key of every query.
+
+        Returns:
+        ndarray: Index of the episode holding at every query, -1 if none.
+    """
+    # blocks[k][j] is the maximum of end_key[j - 2**k + 1:j + 1] (of end_key[:j + 1] near the start).
+    blocks = [end_key]
+    while 2 ** len(blocks) <= len(end_key):
+        step = 2 ** (len(blocks) - 1)
+        block = blocks[-1].copy()
+        block[step:] = np.maximum(blocks[-1][step:], blocks[-1][:-step])
+        blocks.append(block)
+
+    position = candidate.copy()
+    for k in reversed(range(len(blocks))):
+        valid = np.flatnonzero(position >= 0)
+        ended = valid[blocks[k][position[valid]] <= t[valid]]
+        position[ended] -= 2 ** k
+    return np.maximum(position, -1)
+
+
+@profiler.stage('joint_state_timeline')
+def joint_state_timeline(annotations, dimensions):
+    """
+        Joint-state timeline of any set of tiers: every participant's session is cut
+        at every start and end of the selected episodes, and each resulting segment
+        gets the state of every dimension (e.g. left hand x right hand x position)
+        that holds during it. Consecutive segments with the same states are merged.
+        All participants and dimensions are handled in one vectorised pass over
+        sorted interval arrays.
+
+        Parameters:
+        annotations (pd.DataFrame or list): Tables with 'id', 'Tier', 'StartTime' and
+                                            'EndTime', e.g. [body, manual].
+        dimensions (dict): Dimension name -> spec with the keys
+                           tiers (list): tiers of the dimension, in priority order
+                                         where their episodes overlap (within a
+                                         tier the latest started episode that
+                                         still lasts holds);
+                           label (str): column holding the state (e.g. 'Object'),
+                                        the tier name if missing;
+                           values (list): states kept (before mapping), all if missing;
+                           mapping (dict or function): relabelling of the states,
+                                                       states mapped to NaN are dropped;
+                           min_duration (int): only episodes longer than this (ms).
+                           See sampling_dimensions.
+
+        Returns:
+        pd.DataFrame: id, StartTime, EndTime, Duration and one categorical column per
+                      dimension (NaN where the dimension has no episode), one row
+                      per maximal stretch of constant joint state in which at least
+                      one dimension is active.
+    """
+    if isinstance(annotations, pd.DataFrame):
+        annotations = [annotations]
+
+    sources = []
+    categories = {}
+    for d, (name, spec) in enumerate(dimensions.items()):
+        rows, state = _dimension_rows(annotations, spec)
+        categories[name] = sorted(state.unique())
+        codes = pd.Index(categories[name]).get_indexer(state)
+        for tier in spec['tiers']:
+            in_tier = (rows['Tier'] == tier).to_numpy()
+            sources.append((d, rows['id'].to_numpy(np.int64)[in_tier], rows['StartTime'].to_numpy(np.int64)[in_tier],
+                            rows['EndTime'].to_numpy(np.int64)[in_tier], codes[in_tier]))
+
+    span = max([int(source[3].max(initial=0)) for source in sources] + [0]) + 1
+
+    # Elementary segments between consecutive boundaries of the same participant.
+    boundaries = np.unique(np.concatenate([ids * span + times for _, ids, starts, ends, _ in sources
+                                           for times in (starts, ends)] + [np.array([], dtype=np.int64)]))
+    same_id = boundaries[1:] // span == boundaries[:-1] // span
+    seg_key = boundaries[:-1][same_id]
+    seg_end_key = boundaries[1:][same_id]
+    seg_id = seg_key // span
+
+    states = np.full((len(dimensions), len(seg_key)), -1, dtype=np.int64)
+    for d, ids, starts, ends, codes in sources:
+        if not len(ids):
+            continue
+        order = np.lexsort((starts, ids))
+        ids, starts, ends, codes = ids[order], starts[order], ends[order], codes[order]
+        # Within a tier the most recently started episode that still lasts holds;
+        # end keys of earlier participants never reach the segment keys of later ones.
+        candidate = np.searchsorted(ids * span + starts, seg_key, side='right') - 1
+        holding = _latest_active(ids * span + ends, candidate, seg_key)
+        unset = (holding >= 0) & (states[d] == -1)
+        states[d][unset] = codes[holding[unset]]
+
+    active = (states >= 0).any(axis=0)
+    seg_key, seg_end_key, seg_id, states = seg_key[active], seg_end_key[active], seg_id[active], states[:, active]
+
+    new_run = np.ones(len(seg_key), dtype=bool)
+    new_run[1:] = (seg_id[1:] != seg_id[:-1]) | (seg_key[1:] != seg_end_key[:-1]) | \
+                  (states[:, 1:] != states[:, :-1]).any(axis=0)
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:], len(seg_key)) - 1
+
+    timeline = pd.DataFrame({'id': seg_id[first],
+                             'StartTime': seg_key[first] - seg_id[first] * span,
+                             'EndTime': seg_end_key[last] - seg_id[first] * span})
+    timeline['Duration'] = timeline['EndTime'] - timeline['StartTime']
+    for d, name in enumerate(dimensions):
+        timeline[name] = pd.Categorical.from_codes(states[d][first], categories=categories[name])
+    return timeline
+
+
+def joint_state_durations(timeline, dimensions=None, min_duration=0):
+    """
+        Total time and number of stretches of every joint state per participant.
+
+        Parameters:
+        timeline (pd.DataFrame): Output of joint_state_timeline.
+        dimensions (list): Dimensions the states are formed of, all if None;
+                           stretches where one of them is inactive are left out.
+        min_duration (int): Only count stretches longer than this (ms).
+
+        Returns:
+        pd.DataFrame: id, the dimensions, Duration (total, ms) and count.
+    """
+    if dimensions is None:
+        dimensions = [c for c in timeline.columns if c not in ('id', 'StartTime', 'EndTime', 'Duration')]
+    timeline = timeline[timeline[dimensions].notna().all(axis=1) & (timeline['Duration'] > min_duration)]
+    return timeline.groupby(['id'] + list(dimensions), observed=True)['Duration'] \
+        .agg(Duration='sum', count='count').reset_index()
@@ -0,0 +1,124 @@
+import argparse
+import glob
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the extraction in import_data changes what is stored for a file.
+CACHE_VERSION = 2
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def file_key(file, tiers_analysis):
+    """
+        Cache key of an ELAN file: a SHA-256 of its content, its name (the id is
+        derived from it), the analysed tiers and CACHE_VERSION.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{CACHE_VERSION}|{os.path.basename(file)}|{','.join(sorted(tiers_analysis))}|".encode())
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key + '.npz')
+
+
+def _frame_to_arrays(prefix, df):
+    if df is None:
+        return {}
+    arrays = {f'{prefix}_columns': np.array(df.columns, dtype=str)}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if pd.api.types.infer_dtype(values) == 'integer':
+            arrays[f'{prefix}:{column}'] = values.astype(np.int64)
+        else:
+            arrays[f'{prefix}:{column}'] = values.astype(str)
+    return arrays
+
+
+def _arrays_to_frame(prefix, data):
+    if f'{prefix}_columns' not in data:
+        return None
+    columns = data[f'{prefix}_columns'].tolist()
+    df = pd.DataFrame({column: data[f'{prefix}:{column}'] for column in columns}, columns=columns)
+    return df.astype({column: object for column in columns if data[f'{prefix}:{column}'].dtype.kind == 'U'})
+
+
+def load(cache_dir, key):
+    """
+        Returns the cached (df_pos, df_man) of a file, or None on a miss. Either
+        frame is None when the file had no matching tier. Unreadable entries are
+        treated as misses.
+    """
+    path = _entry_path(cache_dir, key)
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            entry = _arrays_to_frame('body', data), _arrays_to_frame('manual', data)
+    except (OSError, ValueError, KeyError):
+        return None
+    # Reading an entry marks it as recently used for evict.
+    os.utime(path)
+    return entry
+
+
+def store(cache_dir, key, df_pos, df_man):
+    """
+        Stores the parsed tables of a file as one .npz archive of columns. The
+        archive is written to a temporary name first, so concurrent workers never
+        see a partially written entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, key)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **_frame_to_arrays('body', df_pos), **_frame_to_arrays('manual', df_man))
+    os.replace(tmp, path)
+
+
+def evict(cache_dir, max_bytes=MAX_CACHE_BYTES):
+    """
+        Removes the least recently used entries until the cache is no larger than
+        max_bytes. Returns the number of removed entries.
+    """
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, '*.npz')):
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def invalidate(cache_dir):
+    """
+        Removes every entry of the cache. Returns the number of removed entries.
+    """
+    paths = glob.glob(os.path.join(cache_dir, '*.npz')) + glob.glob(os.path.join(cache_dir, '*.tmp'))
+    for path in paths:
+        os.remove(path)
+    return len(paths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the cache of parsed ELAN files.')
+    parser.add_argument('command', choices=['invalidate', 'evict'])
+    parser.add_argument('cache_dir')
+    parser.add_argument('--max-bytes', type=int, default=MAX_CACHE_BYTES)
+    args = parser.parse_args()
+
+    if args.command == 'invalidate':
+        print(f'Removed {invalidate(args.cache_dir)} entries.')
+    else:
+        print(f'Removed {evict(args.cache_dir, args.max_bytes)} entries.')
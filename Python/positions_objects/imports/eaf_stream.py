@@ -0,0 +1,161 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+
+def _annotation_value(elem):
+    if len(elem) == 0:
+        return ''
+    return elem[0].text or ''
+
+
+def _resolve_refs(file, refs):
+    """
+        Finds the time slots of the alignable annotations that the reference
+        annotations in refs (annotation id -> referenced id) point to, following
+        chains of references. Each pass streams the file once and only keeps the
+        ids that are still unresolved.
+    """
+    resolved = {}
+    pending = {ref: {ref} for ref in set(refs.values())}
+    while pending:
+        next_pending = {}
+        for _, elem in ET.iterparse(file, events=('end',)):
+            if elem.tag in ('ALIGNABLE_ANNOTATION', 'REF_ANNOTATION'):
+                annotation_id = elem.attrib['ANNOTATION_ID']
+                if annotation_id in pending:
+                    if elem.tag == 'ALIGNABLE_ANNOTATION':
+                        for origin in pending[annotation_id]:
+                            resolved[origin] = (elem.attrib['TIME_SLOT_REF1'], elem.attrib['TIME_SLOT_REF2'])
+                    else:
+                        next_pending.setdefault(elem.attrib['ANNOTATION_REF'], set()).update(pending[annotation_id])
+            elif elem.tag == 'ANNOTATION':
+                elem.clear()
+        if set(next_pending) == set(pending):
+            raise KeyError(f'Unresolvable annotation references in {file}')
+        pending = next_pending
+
+    return {annotation_id: resolved[ref] for annotation_id, ref in refs.items()}
+
+
+def _time_values(file, slot_ids):
+    """
+        Time values (None if unaligned) of the time slots slot_ids. Only the
+        TIME_ORDER at the head of the document is streamed, and slots are dropped
+        as soon as they are read.
+    """
+    values = {}
+    time_order = None
+    for event, elem in ET.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'TIME_ORDER':
+                time_order = elem
+        elif elem.tag == 'TIME_SLOT':
+            slot_id = elem.attrib['TIME_SLOT_ID']
+            if slot_id in slot_ids:
+                value = elem.attrib.get('TIME_VALUE')
+                values[slot_id] = None if value is None else int(value)
+            time_order.clear()
+        elif elem.tag == 'TIME_ORDER':
+            break
+    return values
+
+
+def read_tiers(file, keep=None):
+    """
+        Streams an ELAN (.eaf) file with iterparse and keeps only the annotations
+        accepted by keep(tier, value). Every element is cleared once it has been
+        read, and the kept annotations hold their time slot ids until a second
+        pass over the TIME_ORDER (at the head of the document) looks up the values
+        of those slots only, so memory grows with the kept annotations and not
+        with the size of the document.
+
+        Parameters:
+        file (str): Path of the ELAN file.
+        keep (callable): keep(tier, value) -> bool; None keeps every annotation.
+
+        Returns:
+        tuple: (tier_names, annotations) where tier_names lists every tier in
+               document order and annotations maps each tier to a tuple of
+               (start, end, value) arrays in document order. As in pympi, a tier
+               holding reference annotations only reports those, timed by the
+               alignable annotation they refer to.
+    """
+    tier_names = []
+    aligned = {}
+    referenced = {}
+    refs = {}
+    tier = None
+    time_order = None
+
+    for event, elem in ET.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'TIER':
+                tier = elem.attrib['TIER_ID']
+                if tier not in aligned:
+                    tier_names.append(tier)
+                aligned[tier] = ([], [], [])
+                referenced[tier] = None
+            elif elem.tag == 'TIME_ORDER':
+                time_order = elem
+            continue
+
+        if elem.tag == 'TIME_SLOT':
+            time_order.clear()
+        elif elem.tag == 'ALIGNABLE_ANNOTATION':
+            value = _annotation_value(elem)
+            if keep is None or keep(tier, value):
+                starts, ends, values = aligned[tier]
+                starts.append(elem.attrib['TIME_SLOT_REF1'])
+                ends.append(elem.attrib['TIME_SLOT_REF2'])
+                values.append(value)
+        elif elem.tag == 'REF_ANNOTATION':
+            if referenced[tier] is None:
+                referenced[tier] = []
+            value = _annotation_value(elem)
+            if keep is None or keep(tier, value):
+                annotation_id = elem.attrib['ANNOTATION_ID']
+                refs[annotation_id] = elem.attrib['ANNOTATION_REF']
+                referenced[tier].append((annotation_id, value))
+        elif elem.tag in ('ANNOTATION', 'TIER', 'TIME_ORDER'):
+            elem.clear()
+
+    slots = _resolve_refs(file, refs) if refs else {}
+    slot_refs = {}
+    for name in tier_names:
+        if referenced[name] is None:
+            slot_refs[name] = aligned[name]
+        else:
+            slot_refs[name] = ([slots[annotation_id][0] for annotation_id, _ in referenced[name]],
+                               [slots[annotation_id][1] for annotation_id, _ in referenced[name]],
+                               [value for _, value in referenced[name]])
+    timeslots = _time_values(file, {slot for starts, ends, _ in slot_refs.values() for slot in starts + ends})
+
+    annotations = {}
+    for name in tier_names:
+        starts, ends, values = slot_refs[name]
+        times = []
+        for slot_ids in (starts, ends):
+            values_ms = [timeslots[slot_id] for slot_id in slot_ids]
+            if None in values_ms:
+                raise ValueError(f'Unaligned time slot in tier {name} of {file}')
+            times.append(np.array(values_ms, dtype=np.int64))
+        annotations[name] = (times[0], times[1], np.array(values, dtype=str))
+    return tier_names, annotations
+
+
+class StreamedEaf:
+    """
+        Read-only stand-in for pympi.Elan.Eaf built by read_tiers, exposing the two
+        methods the extractors in import_data use.
+    """
+
+    def __init__(self, file, keep=None):
+        self.tier_names, self.annotations = read_tiers(file, keep)
+
+    def get_tier_names(self):
+        return list(self.tier_names)
+
+    def get_annotation_data_for_tier(self, id_tier):
+        starts, ends, values = self.annotations[id_tier]
+        return list(zip(starts.tolist(), ends.tolist(), values.tolist()))
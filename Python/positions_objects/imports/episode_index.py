@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+
+
+def _expand_ranges(starts, counts):
+    """
+        Expands the ranges [starts[i], starts[i] + counts[i]) into (owner, index)
+        arrays with one entry per element, owner being the position i of the range.
+    """
+    owner = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+class EpisodeIndex:
+    """
+        Index of annotation episodes (position, manual, ...) keyed by participant
+        id, tier and start time, answering "episodes of id X on tier T overlapping
+        [t0, t1)" with two binary searches.
+
+        The episodes are sorted per (id, Tier) by start time and laid out on a
+        single time axis, offset by group, so that the lookups of many queries are
+        vectorised np.searchsorted calls. Episodes within a tier may overlap: the
+        end times are searched through their running maximum, which is monotone.
+
+        Parameters:
+        episodes (pd.DataFrame): Episodes with 'id', 'Tier', 'StartTime' and 'EndTime'.
+    """
+
+    def __init__(self, episodes):
+        self.episodes = episodes
+        tier = episodes['Tier'].astype('category')
+        self.tier_dtype = tier.cat.reorder_categories(sorted(tier.cat.categories)).dtype
+        tier_codes = pd.Categorical(tier, dtype=self.tier_dtype).codes.astype(np.int64)
+        ids = episodes['id'].to_numpy(dtype=np.int64)
+        starts = episodes['StartTime'].to_numpy(dtype=np.int64)
+        self.order = np.lexsort((starts, tier_codes, ids))
+        self.start = starts[self.order]
+        self.end = episodes['EndTime'].to_numpy(dtype=np.int64)[self.order]
+
+        # Consecutive runs of the same (id, Tier) form the groups, numbered in sorted order.
+        ids, tier_codes = ids[self.order], tier_codes[self.order]
+        new_group = np.ones(len(self.order), dtype=bool)
+        new_group[1:] = (ids[1:] != ids[:-1]) | (tier_codes[1:] != tier_codes[:-1])
+        group = np.cumsum(new_group) - 1
+        self.group_first = np.append(np.flatnonzero(new_group), len(self.order))
+        self.group_id = ids[self.group_first[:-1]]
+        self.group_tier = tier_codes[self.group_first[:-1]]
+        self._group_keys = self.group_id * len(self.tier_dtype.categories) + self.group_tier
+
+        # Every group gets its own stretch of the time axis, so keys never collide
+        # across groups; query times are clamped to just outside the annotated range.
+        self._span = int(self.end.max(initial=0)) + 3
+        self._start_key = group * self._span + self.start + 1
+        self._end_key = np.maximum.accumulate(group * self._span + self.end + 1)
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def tiers(self):
+        return list(self.tier_dtype.categories)
+
+    def _key(self, group, t):
+        return group * self._span + np.clip(t, -1, self._span - 2) + 1
+
+    def groups(self, ids, tiers):
+        """
+            Group number of every (id, tier) pair, -1 where the participant has no
+            episode on that tier.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        tier_codes = self.tier_dtype.categories.get_indexer(np.asarray(tiers, dtype=object)).astype(np.int64)
+        keys = ids * len(self.tier_dtype.categories) + tier_codes
+        group = np.searchsorted(self._group_keys, keys)
+        found = (tier_codes >= 0) & (group < len(self._group_keys))
+        found[found] = self._group_keys[group[found]] == keys[found]
+        return np.where(found, group, -1)
+
+    def participant_groups(self, ids):
+        """
+            The range [lo, hi) of group numbers (one per tier) of every participant.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        return np.searchsorted(self.group_id, ids, side='left'), np.searchsorted(self.group_id, ids, side='right')
+
+    def _search(self, group, starts, ends):
+        first = np.searchsorted(self._end_key, self._key(group, starts), side='right')
+        stop = np.searchsorted(self._start_key, self._key(group, ends), side='left')
+        return first, stop
+
+    def search(self, group, starts, ends, first_only=False):
+        """
+            Vectorised overlap search: the episodes of group[i] overlapping
+            [starts[i], ends[i]), in start time order.
+
+            Parameters:
+            group (ndarray): Group numbers, see groups; -1 matches nothing.
+            starts, ends (ndarray): Query windows.
+            first_only (bool): Only the first overlapping episode of every query.
+
+            Returns:
+            tuple: (query, hit) arrays, query indexing the queries and hit the
+                   episodes in sorted order (see episodes_at).
+        """
+        group = np.asarray(group, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        first, stop = self._search(group, starts, ends)
+        valid = group >= 0
+        if first_only:
+            query = np.flatnonzero(valid & (first < stop))
+            return query, first[query]
+        query, hit = _expand_ranges(first, np.where(valid, np.maximum(stop - first, 0), 0))
+        # Between the first match and the last candidate, nested episodes may have ended already.
+        keep = self.end[hit] > starts[query]
+        return query[keep], hit[keep]
+
+    def episodes_at(self, hit):
+        """
+            Rows of the indexed episodes at sorted positions hit.
+        """
+        return self.episodes.iloc[self.order[hit]]
+
+    def overlapping(self, id, tier, start, end):
+        """
+            The episodes of participant id on tier overlapping [start, end), in
+            start time order.
+        """
+        group = self.groups([id], [tier])
+        _, hit = self.search(group, [start], [end])
+        return self.episodes_at(hit)
+
+    def clip(self, episodes, all_overlaps=False):
+        """
+            Clips episodes (e.g. manual sampling) to the indexed episodes of the same
+            participant, on every tier at once.
+
+            Parameters:
+            episodes (pd.DataFrame): Episodes to clip, with 'id', 'StartTime' and 'EndTime'.
+            all_overlaps (bool): If False, only the first overlapping episode (in
+                                 start time order) of each tier is used. If True,
+                                 one row is emitted per overlapping episode.
+
+            Returns:
+            pd.DataFrame: The columns of episodes with clipped 'StartTime'/'EndTime'
+                          and the tier in 'Position', ordered by input episode and
+                          then by tier name. Episodes without overlap are dropped.
+        """
+        ep_start = episodes['StartTime'].to_numpy(dtype=np.int64)
+        ep_end = episodes['EndTime'].to_numpy(dtype=np.int64)
+
+        # Pair every episode with each tier of its participant; the groups of a
+        # participant are contiguous, so these pairs come out ordered by episode and tier.
+        lo, hi = self.participant_groups(episodes['id'].to_numpy(dtype=np.int64))
+        row, pair_group = _expand_ranges(lo, hi - lo)
+
+        pair, hit = self.search(pair_group, ep_start[row], ep_end[row], first_only=not all_overlaps)
+
+        clipped = episodes.iloc[row[pair]].copy()
+        clipped['StartTime'] = np.maximum(ep_start[row[pair]], self.start[hit])
+        clipped['EndTime'] = np.minimum(ep_end[row[pair]], self.end[hit])
+        clipped['Position'] = pd.Categorical.from_codes(self.group_tier[pair_group[pair]], dtype=self.tier_dtype)
+        return clipped
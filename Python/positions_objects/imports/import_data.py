@@ -3,203 +3,498 @@ import numpy as np
 import pympi
 import glob
 import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from imports import column_store, eaf_cache, eaf_stream
+from imports.episode_index import EpisodeIndex
+from profiling import profiler
+
+TIERS_ANALYSIS = ['inhand_right_child', 'inhand_left_child']
+
+# The sampling analysis: in-hand tiers compared, toys and their categories,
+# minimal length of a position episode (ms) and the split of the positions.
+LIMB_TIERS = ['inhand_left_child', 'inhand_right_child']
+TOY_CATEGORIES = {'bubbles': 'graspable',
+                  'dino': 'graspable',
+                  'klickity': 'stationary',
+                  'spinner': 'stationary'}
+MIN_POSITION_DURATION = 3000
+NON_POSITION_TIERS = ['Claps', 'Undefined']
+POSITION_SPLIT = {'Sitting': 'Independent sitting'}
+OTHER_POSITION = 'Other'
+
+# Column types of the tables passed between the stages: times in milliseconds as
+# int32 (enough for sessions of up to 24 days), tiers and labels as categoricals
+# and the participant id as the integer parsed from the first five characters of
+# the file name.
+BODY_DTYPES = {'StartTime': 'int32', 'EndTime': 'int32', 'Duration': 'int32', 'Tier': 'category',
+               'id': 'int32', 'TimePoint': 'category'}
+MANUAL_DTYPES = {'StartTime': 'int32', 'EndTime': 'int32', 'Duration': 'int32', 'Tier': 'category',
+                 'Object': 'category', 'id': 'int32', 'TimePoint': 'category'}
+SAMPLING_DTYPES = {'StartTime': 'int32', 'EndTime': 'int32', 'Duration': 'int32', 'Tier': 'category',
+                   'Object': 'category', 'Position': 'category', 'id': 'int32'}
+# extract_sampling_across_positions reports durations in seconds.
+SAMPLING_SECONDS_DTYPES = {**SAMPLING_DTYPES, 'Duration': 'float64'}
+
+def _extract_body(elan_file, filename):
+    """
+       Collects the position episodes (empty-valued annotations on every tier
+       except 'Claps') of a single parsed ELAN file.
 
-def generateBodyDescriptives(DIR):
+       Returns:
+       pd.DataFrame or None: The episodes sorted by start time, or None when the
+                             file has no tier other than 'Claps'.
     """
-       Extracts and processes body movement annotation data from ELAN (.eaf) files,
-       compiling them into a structured dataset.
+    tiers = [tier for tier in elan_file.get_tier_names() if tier != 'Claps']
+    if not tiers:
+        return None
 
-       Parameters:
-       timepoint (str): The timepoint directory containing the ELAN files.
+    records = []
+    for tier in tiers:
+        for ann in elan_file.get_annotation_data_for_tier(tier):
+            if ann[2] == "":
+                records.append((ann[0], ann[1], ann[1] - ann[0], tier, int(filename[:5]), filename[-1]))
+
+    return _records_to_frame(records, list(BODY_DTYPES))
+
+def _extract_manual(elan_file, filename, tiers_analysis):
+    """
+       Collects the in-hand episodes (annotations with an object label on the
+       tiers in tiers_analysis) of a single parsed ELAN file.
 
        Returns:
-       pd.DataFrame: A DataFrame containing the extracted body movement data,
-                     sorted by ID and start time, and saved as a CSV file.
+       pd.DataFrame or None: The episodes sorted by start time, or None when the
+                             file has none of the tiers in tiers_analysis.
     """
-    data_pos = {}
-    for file in glob.glob(DIR+'/*.eaf'):
-        elan_file = pympi.Elan.Eaf(file)
-        filename = os.path.basename(file)[:7]
-        df_pos = pd.DataFrame(columns=['StartTime', 'EndTime', 'Duration', 'Tier'])
+    tiers = [tier for tier in elan_file.get_tier_names() if tier in tiers_analysis]
+    if not tiers:
+        return None
 
-        for tier in elan_file.get_tier_names():
-            if tier != 'Claps':
-                for ann in elan_file.get_annotation_data_for_tier(tier):
-                    if ann[2] == "":
-                        df3 = pd.DataFrame(
-                            {'id': filename, 'TimePoint': filename[-1], 'StartTime': ann[0], 'EndTime': ann[1], 'Duration': ann[1] - ann[0],
-                             'Tier': tier}, index=[0])
-                        df_pos = pd.concat([df_pos, df3], ignore_index=True)
+    records = []
+    for tier in tiers:
+        for ann in elan_file.get_annotation_data_for_tier(tier):
+            if ann[2] != "":
+                records.append((ann[0], ann[1], ann[1] - ann[0], tier, ann[2], int(filename[:5]), filename[-1]))
 
-                data_pos[filename] = df_pos.sort_values('StartTime').reset_index(drop=True)
+    return _records_to_frame(records, list(MANUAL_DTYPES))
 
-    body = pd.concat(data_pos.values(), ignore_index=True)
-    body = body.sort_values(['id', 'StartTime']).reset_index(drop=True)
+def _records_to_frame(records, columns):
+    """
+       Builds the per-file frame in one go from the collected annotation tuples,
+       sorted by start time. The compact column types are applied once all files
+       are combined, so that the categories are shared across participants.
+    """
+    df = pd.DataFrame.from_records(records, columns=columns)
+    return df.sort_values('StartTime', kind='mergesort').reset_index(drop=True)
 
+def _participant_ids(ids):
+    """
+       Integer participant ids from either integers or the former '<id>_T' strings
+       (e.g. in body.csv/manual.csv written by older versions).
+    """
+    if pd.api.types.is_integer_dtype(ids):
+        return ids
+    return ids.astype(str).str[:5].astype(int)
+
+def _as_schema(df, dtypes):
+    df = df.copy()
+    df['id'] = _participant_ids(df['id'])
+    return df.astype(dtypes)
+
+def combine_body(data_pos):
+    """
+        Builds the body table (as generateBodyDescriptives returns it) from the
+        body frames of parse_file, keyed by file name.
+    """
+    body = _as_schema(pd.concat(data_pos.values(), ignore_index=True), BODY_DTYPES)
+    body = body.sort_values(['id', 'StartTime']).reset_index(drop=True)
     return body
 
-def generateManualDescriptives(DIR):
+def combine_manual(data_manual):
     """
-        Extracts and processes manual annotation data from ELAN (.eaf) files,
-        focusing on specific tiers related to object handling.
+        Builds the manual table (as generateManualDescriptives returns it) from the
+        manual frames of parse_file, keyed by file name.
+    """
+    manual = _as_schema(pd.concat(data_manual.values(), ignore_index=True), MANUAL_DTYPES)
+    manual = manual.sort_values(['id', 'StartTime'])
+    return manual
+
+def _keep_annotation(tier, value):
+    return (tier != 'Claps' and value == "") or (tier in TIERS_ANALYSIS and value != "")
+
+def _read_eaf(file, body=True, manual=True, backend='pympi'):
+    if backend == 'stream':
+        elan_file = eaf_stream.StreamedEaf(file, keep=_keep_annotation)
+    else:
+        elan_file = pympi.Elan.Eaf(file)
+    filename = os.path.basename(file)[:7]
+    df_pos = _extract_body(elan_file, filename) if body else None
+    df_man = _extract_manual(elan_file, filename, TIERS_ANALYSIS) if manual else None
+    return filename, df_pos, df_man
+
+@profiler.stage('parse_file', participant=lambda file, *args, **kwargs: os.path.basename(file)[:5])
+def parse_file(file, body=True, manual=True, cache_dir=None, backend='pympi'):
+    """
+        Parses one ELAN file into its body and manual frames, which combine_body and
+        combine_manual turn into the tables of generateDescriptives.
 
         Parameters:
-        timepoint (str): The timepoint directory containing the ELAN files.
+        file (str): Path of the ELAN file.
+        body, manual (bool): Whether to extract the body and the manual frame.
+        cache_dir (str): Optional cache of parsed files, see eaf_cache.
+        backend (str): 'pympi' or 'stream', see generateDescriptives.
 
         Returns:
-        pd.DataFrame: A DataFrame containing the extracted manual annotation data,
-                      sorted by ID and start time, and saved as a CSV file.
+        tuple: (filename, df_pos, df_man); filename is the first 7 characters of
+               the file name, and a frame is None if not extracted.
+    """
+    if cache_dir is None:
+        return _read_eaf(file, body, manual, backend)
+
+    key = eaf_cache.file_key(file, TIERS_ANALYSIS)
+    cached = eaf_cache.load(cache_dir, key)
+    if cached is None:
+        _, df_pos, df_man = _read_eaf(file, backend=backend)
+        eaf_cache.store(cache_dir, key, df_pos, df_man)
+    else:
+        df_pos, df_man = cached
+    return os.path.basename(file)[:7], df_pos if body else None, df_man if manual else None
+
+def _parse_files(files, body, manual, workers, cache_dir, backend):
+    """
+        Parses the files serially or, if workers > 1, in a process pool. Results are
+        yielded in the order of files as (file, result); a file that fails to parse
+        yields the raised exception as its result instead of aborting the run. The
+        profiler records of the workers are merged into those of this process.
     """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(profiler.call_recorded, profiler.modes(), parse_file, file, body, manual,
+                                       cache_dir, backend) for file in files]
+            for file, future in zip(files, futures):
+                try:
+                    result, records = future.result()
+                except Exception as err:
+                    yield file, err
+                    continue
+                profiler.merge(records)
+                yield file, result
+    else:
+        for file in files:
+            try:
+                yield file, parse_file(file, body, manual, cache_dir, backend)
+            except Exception as err:
+                yield file, err
+
+def _read_directory(DIR, body=True, manual=True, workers=1, cache_dir=None, backend='pympi'):
+    data_pos = {}
     data_manual = {}
-    tiers_analysis = ['inhand_right_child', 'inhand_left_child']
-    for file in glob.glob(DIR+'/*.eaf'):
-
-        elan_file = pympi.Elan.Eaf(file)
-        filename = os.path.basename(file)[:7]
-        df_man = pd.DataFrame(columns=['StartTime', 'EndTime', 'Duration', 'Tier', 'Object'])
-        for tier in elan_file.get_tier_names():
-            if tier in tiers_analysis:
-                for ann in elan_file.get_annotation_data_for_tier(tier):
-                    if ann[2] != "":
-                        df2 = pd.DataFrame({'id': filename, 'TimePoint': filename[-1], 'StartTime': ann[0], 'EndTime': ann[1],
-                                            'Duration': ann[1] - ann[0], 'Tier': tier, 'Object': ann[2]}, index=[0])
-                        df_man = pd.concat([df_man, df2], ignore_index=True)
-
-                data_manual[filename] = df_man.sort_values('StartTime').reset_index(drop=True)
-    manual = pd.concat(data_manual.values(), ignore_index=True)
-
-    manual = manual.sort_values(['id', 'StartTime'])
-    return manual
-
-def check_sitting(row, participant_data_bod):
-    new_row = pd.Series(dtype=float)
-    new_row['Object'] = row['Object']
-    new_row['Tier'] = row['Tier']
-    new_row['id'] = row['id']
-    new_row['StartTime'] = np.nan
-    new_row['EndTime'] = np.nan
-
-    for idx, sitting_ep in participant_data_bod.iterrows():
-        if (row['StartTime'] < sitting_ep['EndTime']) & (row['EndTime'] > sitting_ep['StartTime']):
-            if row['StartTime'] < sitting_ep['StartTime']:
-                new_row['StartTime'] = sitting_ep['StartTime']
-            elif row['StartTime'] >= sitting_ep['StartTime']:
-                new_row['StartTime'] = row['StartTime']
-            else:
-                continue
-            if row['EndTime'] > sitting_ep['EndTime']:
-                new_row['EndTime'] = sitting_ep['EndTime']
-
-            elif row['EndTime'] <= sitting_ep['EndTime']:
-                new_row['EndTime'] = row['EndTime']
-            else:
-                continue
-            return new_row
-        else:
+    files = glob.glob(DIR+'/*.eaf')
+    for file, result in _parse_files(files, body, manual, workers, cache_dir, backend):
+        if isinstance(result, Exception):
+            warnings.warn(f"Skipping {file}: {result!r}")
             continue
+        filename, df_pos, df_man = result
+        if df_pos is not None:
+            data_pos[filename] = df_pos
+        if df_man is not None:
+            data_manual[filename] = df_man
 
-    return new_row
-
-def calculate_sampling_across_positions(manual, body, position, toys):
+    if cache_dir is not None:
+        eaf_cache.evict(cache_dir)
 
-    sampling_across_positions = pd.DataFrame(
-        columns=['StartTime', 'EndTime', 'Duration', 'Tier', 'Object', 'Position', 'id'])
-    manual['Object'] = manual['Object'].apply(lambda x: x if x in toys else np.nan)
-    limbs_dict = {}
+    return data_pos, data_manual
 
-    for limb, label in zip(['inhand_left_child', 'inhand_right_child'],
-                           ['change_left', 'change_right']):
-        manual_cop = manual.copy()
-        manual_cop['Tier'] = manual_cop['Tier'].apply(lambda x: x if x == limb else np.nan)
-        manual_cop = manual_cop.dropna()
-        limbs_dict[label] = manual_cop
+def eaf_file_keys(DIR):
+    """
+        Content keys (see eaf_cache.file_key) of the ELAN files of DIR, by the
+        file name prefix the parsed tables are keyed on (e.g. '10001_T').
+    """
+    return {os.path.basename(file)[:7]: eaf_cache.file_key(file, TIERS_ANALYSIS) for file in glob.glob(DIR+'/*.eaf')}
 
-    body['Tier'] = body['Tier'].apply(lambda x: x if x in position else np.nan)
-    body = body.dropna()
-    body = body[body['Duration'] > 3000]
+@profiler.stage('generateBodyDescriptives')
+def generateBodyDescriptives(DIR, workers=1, cache_dir=None, backend='pympi'):
+    """
+       Extracts and processes body movement annotation data from ELAN (.eaf) files,
+       compiling them into a structured dataset.
 
-    participants = manual['id'].unique()
+       Parameters:
+       timepoint (str): The timepoint directory containing the ELAN files.
+       workers (int): Number of processes parsing the files; 1 parses serially.
+       cache_dir (str): Optional directory caching the parsed files (see eaf_cache);
+                        only new or changed files are parsed again.
+       backend (str): 'pympi' loads whole documents, 'stream' reads only the needed
+                      annotations with eaf_stream.
 
-    rows = ['change_left', 'change_right']
+       Returns:
+       pd.DataFrame: A DataFrame containing the extracted body movement data,
+                     sorted by ID and start time, and saved as a CSV file.
+    """
+    data_pos, _ = _read_directory(DIR, manual=False, workers=workers, cache_dir=cache_dir, backend=backend)
+    return combine_body(data_pos)
 
-    for idx, participant in enumerate(participants):
+@profiler.stage('generateManualDescriptives')
+def generateManualDescriptives(DIR, workers=1, cache_dir=None, backend='pympi'):
+    """
+        Extracts and processes manual annotation data from ELAN (.eaf) files,
+        focusing on specific tiers related to object handling.
 
-        participant_data_bod = body[body['id'] == participant].reset_index(drop=True)
+        Parameters:
+        timepoint (str): The timepoint directory containing the ELAN files.
+        workers (int): Number of processes parsing the files; 1 parses serially.
+        cache_dir (str): Optional directory caching the parsed files (see eaf_cache);
+                         only new or changed files are parsed again.
+        backend (str): 'pympi' loads whole documents, 'stream' reads only the needed
+                       annotations with eaf_stream.
 
-        for name, group in participant_data_bod.groupby('Tier'):
+        Returns:
+        pd.DataFrame: A DataFrame containing the extracted manual annotation data,
+                      sorted by ID and start time, and saved as a CSV file.
+    """
+    _, data_manual = _read_directory(DIR, body=False, workers=workers, cache_dir=cache_dir, backend=backend)
+    return combine_manual(data_manual)
 
-            for pos, row in zip(range(len(rows)), rows):
-                manual_df = limbs_dict[row].copy()
-                participant_data_man = manual_df[manual_df['id'] == participant].reset_index(drop=True)
+@profiler.stage('generateDescriptives')
+def generateDescriptives(DIR, workers=1, cache_dir=None, backend='pympi'):
+    """
+        Single-pass alternative to calling generateBodyDescriptives and
+        generateManualDescriptives one after the other: every ELAN file is
+        parsed once and both tables are built from the same parse.
 
-                if len(group) != 0:
-                    df_man = participant_data_man.copy()
-                    df_man_cop = df_man.apply(lambda sampling_ep: check_sitting(sampling_ep, group), axis=1)
+        Parameters:
+        DIR (str): The timepoint directory containing the ELAN files.
+        workers (int): Number of processes parsing the files; 1 parses serially.
+                       Files that fail to parse are skipped with a warning.
+        cache_dir (str): Optional directory caching the parsed files (see eaf_cache);
+                         only new or changed files are parsed again.
+        backend (str): 'pympi' loads whole documents, 'stream' reads only the needed
+                       annotations with eaf_stream.
 
-                    if isinstance(df_man_cop, pd.Series):
-                        if (df_man_cop['StartTime'].isna()) | (df_man_cop['EndTime'].isna()):
-                            df_man_cop = pd.DataFrame()
+        Returns:
+        tuple: (body, manual), identical to the outputs of
+               generateBodyDescriptives(DIR) and generateManualDescriptives(DIR).
+    """
+    data_pos, data_manual = _read_directory(DIR, workers=workers, cache_dir=cache_dir, backend=backend)
+    return combine_body(data_pos), combine_manual(data_manual)
 
-                    elif isinstance(df_man_cop, pd.DataFrame):
-                        df_man_cop = df_man_cop.dropna(subset=['StartTime', 'EndTime'])
+@profiler.stage('clip_to_positions')
+def clip_to_positions(episodes, positions, all_overlaps=False):
+    """
+        Clips episodes (e.g. manual sampling) to the position episodes of the same
+        participant, for every participant and every position tier at once, through
+        an EpisodeIndex of the positions.
 
-                    if not df_man_cop.empty:
-                        df_man_cop['Position'] = name
-                        df_man_cop['Duration'] = df_man_cop['EndTime'] - df_man_cop['StartTime']
-                        df_man_cop[['StartTime', 'EndTime', 'Duration', 'id']] = df_man_cop[
-                            ['StartTime', 'EndTime', 'Duration', 'id']].astype(int)
+        Parameters:
+        episodes (pd.DataFrame): Episodes to clip, with 'id', 'StartTime' and 'EndTime'.
+        positions (pd.DataFrame): Position episodes with 'id', 'Tier', 'StartTime' and 'EndTime'.
+        all_overlaps (bool): If False, only the first overlapping episode (in start
+                             time order) of each position tier is used, as in the
+                             former check_sitting. If True, one row is emitted per
+                             overlapping position episode.
 
-                    else:
-                        df_man_cop = pd.DataFrame()
+        Returns:
+        pd.DataFrame: The columns of episodes with clipped 'StartTime'/'EndTime' and
+                      the position tier in 'Position', ordered by input episode and
+                      then by position tier name. Episodes without overlap are dropped.
+    """
+    return EpisodeIndex(positions).clip(episodes, all_overlaps=all_overlaps)
 
-                else:
-                    df_man_cop = pd.DataFrame()
+@profiler.stage('calculate_sampling_across_positions')
+def calculate_sampling_across_positions(manual, body, position, toys, all_overlaps=False, limbs=LIMB_TIERS,
+                                        min_duration=MIN_POSITION_DURATION):
+    # Participants are reported in order of first appearance in manual.
+    participants = manual['id'].unique()
 
-                sampling_across_positions = pd.concat([sampling_across_positions, df_man_cop], axis=0)
+    episodes = manual.loc[manual['Object'].isin(toys) & manual['Tier'].isin(limbs),
+                          ['Object', 'Tier', 'id', 'StartTime', 'EndTime']]
+    episodes['limb'] = pd.Index(limbs).get_indexer(episodes['Tier']).astype(np.int8)
 
-    return sampling_across_positions.reset_index(drop=True)
+    body = body[body['Tier'].isin(position) & (body['Duration'] > min_duration)]
 
-def extract_sampling_across_positions(DIR, body_or=None, manual_or=None):
-    if manual_or is None:
-        manual_or = pd.read_csv(DIR + '/manual.csv', index_col=0)
-    if body_or is None:
-        body_or = pd.read_csv(DIR + '/body.csv', index_col=0)
+    df_man_cop = clip_to_positions(episodes, body, all_overlaps=all_overlaps)
 
-    manual = manual_or.copy()
-    body = body_or.copy()
+    # Same order as looping over participants, position tiers and limbs in turn.
+    rank = pd.Index(participants).get_indexer(df_man_cop['id'])
+    df_man_cop = df_man_cop.iloc[np.lexsort((df_man_cop['limb'].to_numpy(),
+                                             df_man_cop['Position'].cat.codes.to_numpy(), rank))]
 
-    manual['id'] = manual['id'].transform(lambda x: x[:5]).astype(int)
-    body['id'] = body['id'].transform(lambda x: x[:5]).astype(int)
+    df_man_cop['Duration'] = df_man_cop['EndTime'] - df_man_cop['StartTime']
 
-    all_positions = [x for x in body['Tier'].unique() if x not in ["Claps", 'Undefined']]
+    sampling_across_positions = df_man_cop[list(SAMPLING_DTYPES)].astype(SAMPLING_DTYPES)
+    for column in ['Tier', 'Object', 'Position']:
+        sampling_across_positions[column] = sampling_across_positions[column].cat.remove_unused_categories()
+    return sampling_across_positions.reset_index(drop=True)
 
+def compute_sampling_across_positions(manual, body, all_positions, all_overlaps=False):
+    """
+        extract_sampling_across_positions on manual and body tables already in
+        their schema (MANUAL_DTYPES, BODY_DTYPES), over the position tiers
+        all_positions. Used to recompute some participants only, whose rows
+        merge_participants then puts in a previous result.
+    """
     sampling_across_positions = calculate_sampling_across_positions(manual=manual,
                                                                     body=body,
                                                                     position=all_positions,
-                                                                    toys=['bubbles', 'dino', 'klickity', 'spinner'])
+                                                                    toys=list(TOY_CATEGORIES),
+                                                                    all_overlaps=all_overlaps)
 
+    sampling_across_positions['Duration'] = sampling_across_positions['Duration'] / 1000
+    sampling_across_positions['Object'] = _relabel(sampling_across_positions['Object'], TOY_CATEGORIES)
+    sampling_across_positions['Position'] = _relabel(sampling_across_positions['Position'],
+                                                     lambda x: POSITION_SPLIT.get(x, OTHER_POSITION))
 
-    sitting = sampling_across_positions[sampling_across_positions['Position'] == 'Sitting']
-    sitting['Position'] = ['Independent sitting'] * len(sitting)
-    id_sitters = sitting['id'].to_numpy()
+    return sampling_across_positions.astype(SAMPLING_SECONDS_DTYPES)
 
-    sampling_across_positions['sitter_yes_no'] = sampling_across_positions['id'].isin(id_sitters)
-    sampling_across_positions['Duration'] = sampling_across_positions['Duration'] / 1000
-    sampling_across_positions = sampling_across_positions[['StartTime', 'EndTime', 'Duration', 'Tier', 'Object', 'Position', 'id']]
+def _relabel(values, mapping):
+    """
+        Maps the categories of a categorical Series (mapping being a dict or a
+        function) and remaps the codes, so each distinct label is mapped once
+        instead of once per row. Labels missing from a dict mapping become NaN.
+    """
+    labels = pd.Series(values.cat.categories).map(mapping)
+    categories = sorted(labels.dropna().unique())
+    new_codes = np.append(pd.Index(categories).get_indexer(labels), -1)
+    codes = new_codes[values.cat.codes.to_numpy()]
+    relabelled = pd.Categorical.from_codes(codes, categories=categories)
+    return pd.Series(relabelled, index=values.index).cat.remove_unused_categories()
+
+def merge_participants(previous, recomputed, affected, participants):
+    """
+        Replaces the rows of the affected participants in a previous
+        sampling_across_positions table by their recomputed rows.
 
-    map_toys = {'bubbles': 'graspable',
-                'dino': 'graspable',
-                'klickity': 'stationary',
-                'spinner': 'stationary'}
+        Parameters:
+        previous (pd.DataFrame): Previous table, or None.
+        recomputed (pd.DataFrame): Rows of the affected participants.
+        affected (list): Participants whose rows are replaced (or dropped, if they
+                         have no recomputed rows).
+        participants (array): All current participants, in the order a full run
+                              reports them; rows of other participants are dropped.
 
-    sampling_across_positions['Object'] = sampling_across_positions['Object'].replace(map_toys)
-    sampling_across_positions['Position'] = sampling_across_positions['Position'].apply(lambda x: 'Independent sitting' if x=='Sitting' else 'Other')
+        Returns:
+        pd.DataFrame: The updated table, in the order of a full run.
+    """
+    previous = previous if previous is not None else recomputed.iloc[:0]
+    previous = previous[previous['id'].isin(participants) & ~previous['id'].isin(affected)]
+    frames = [df for df in (previous, recomputed) if len(df)] or [recomputed]
+    sampling_across_positions = pd.concat(frames, axis=0).astype(SAMPLING_SECONDS_DTYPES)
+    # As in a full run, labels of dropped participants do not stay behind as categories.
+    for column in ['Tier', 'Object', 'Position']:
+        sampling_across_positions[column] = sampling_across_positions[column].cat.remove_unused_categories()
+
+    participant_rank = pd.Series(np.arange(len(participants)), index=participants)
+    rank = sampling_across_positions['id'].map(participant_rank).to_numpy()
+    return sampling_across_positions.iloc[np.argsort(rank, kind='stable')].reset_index(drop=True)
+
+def _changed_participants(previous, file_keys, all_positions, all_overlaps):
+    """
+        Participants whose rows of a previous extract_sampling_across_positions
+        result (with its file keys in attrs) cannot be reused, None if none can:
+        those with a new, changed or removed file. A change of the position tiers
+        or of all_overlaps affects every participant.
+    """
+    state = previous.attrs.get('sampling_state') if previous is not None else None
+    if state is None or state['positions'] != sorted(all_positions) or state['all_overlaps'] != all_overlaps:
+        return None
+    old_keys = state['file_keys']
+    changed = {filename for filename in set(old_keys) | set(file_keys)
+               if old_keys.get(filename) != file_keys.get(filename)}
+    return sorted({int(filename[:5]) for filename in changed})
+
+@profiler.stage('extract_sampling_across_positions')
+def extract_sampling_across_positions(DIR, body_or=None, manual_or=None, all_overlaps=False, store_dir=None,
+                                      file_keys=None):
+    """
+        Clips the manual sampling episodes to body positions and relabels them as
+        'Independent sitting'/'Other' and graspable/stationary objects.
 
+        Parameters:
+        DIR (str): Directory with manual.csv and body.csv, read if the tables are not given
+                   and not in store_dir.
+        body_or (pd.DataFrame): Output of generateBodyDescriptives.
+        manual_or (pd.DataFrame): Output of generateManualDescriptives.
+        all_overlaps (bool): Emit one row per overlapping position episode instead
+                             of only the first one.
+        store_dir (str): Optional column store (see imports.column_store) the
+                         manual and body tables are loaded from instead of the csv files.
+        file_keys (dict): Keys of the ELAN files the tables were built from (see
+                          eaf_file_keys). With store_dir, only the participants
+                          whose files changed since the sampling_across_positions
+                          table of the store was computed are recomputed, and
+                          merged into it with merge_participants; the keys are kept
+                          in the attrs of the result, for the next run.
+
+        Returns:
+        pd.DataFrame: One row per clipped manual sampling episode.
+    """
+    if manual_or is None:
+        if column_store.has_table(store_dir, 'manual'):
+            manual_or = column_store.read_table(store_dir, 'manual')
+        else:
+            manual_or = pd.read_csv(DIR + '/manual.csv', index_col=0)
+    if body_or is None:
+        if column_store.has_table(store_dir, 'body'):
+            body_or = column_store.read_table(store_dir, 'body')
+        else:
+            body_or = pd.read_csv(DIR + '/body.csv', index_col=0)
+
+    manual = _as_schema(manual_or, MANUAL_DTYPES)
+    body = _as_schema(body_or, BODY_DTYPES)
+
+    all_positions = [x for x in body['Tier'].unique() if x not in NON_POSITION_TIERS]
+
+    if file_keys is None:
+        return compute_sampling_across_positions(manual, body, all_positions, all_overlaps)
+
+    previous = None
+    if column_store.has_table(store_dir, 'sampling_across_positions'):
+        previous = column_store.read_table(store_dir, 'sampling_across_positions')
+    affected = _changed_participants(previous, file_keys, all_positions, all_overlaps)
+    if affected is None:
+        sampling_across_positions = compute_sampling_across_positions(manual, body, all_positions, all_overlaps)
+    else:
+        recomputed = compute_sampling_across_positions(manual[manual['id'].isin(affected)],
+                                                       body[body['id'].isin(affected)], all_positions, all_overlaps)
+        sampling_across_positions = merge_participants(previous, recomputed, affected, manual['id'].unique())
+    sampling_across_positions.attrs['sampling_state'] = {'file_keys': file_keys, 'positions': sorted(all_positions),
+                                                         'all_overlaps': all_overlaps}
     return sampling_across_positions
 
-def extract_sampling_per_id(DIR, sampling_across_positions, aff_label='Object', con_position='Position'):
-    length = pd.read_excel(DIR + '/length_T3.xlsx')[['id', 'video_length']]
+def read_length(DIR, store_dir=None):
+    """
+        Session lengths from length_T3.xlsx in DIR. With store_dir the table is kept
+        in the column store and the Excel file is only parsed again once it changes.
+    """
+    path = DIR + '/length_T3.xlsx'
+    if column_store.has_table(store_dir, 'length'):
+        return column_store.read_table(store_dir, 'length')
+    length = pd.read_excel(path)[['id', 'video_length']]
+    if store_dir is not None:
+        column_store.write_table(length, store_dir, 'length', source=path)
+    return length
+
+@profiler.stage('extract_sampling_per_id')
+def extract_sampling_per_id(DIR, sampling_across_positions, aff_label='Object', con_position='Position',
+                            store_dir=None):
+    length = read_length(DIR, store_dir)
+    counts = sampling_counts(sampling_across_positions, aff_label, con_position)
+    return sampling_per_id_from_counts(counts, sampling_across_positions, length, aff_label, con_position)
+
+def sampling_counts(sampling_across_positions, aff_label='Object', con_position='Position'):
+    """
+        Number and total duration of the sampling episodes per id, object and
+        position, for the cells that occur. Since they are per id, the counts of
+        some participants can be replaced without touching the others.
+    """
+    return sampling_across_positions.groupby(['id', aff_label, con_position], observed=True)['Duration'].agg(['count', 'sum'])
 
+def sampling_per_id_from_counts(counts, sampling_across_positions, length, aff_label='Object', con_position='Position'):
+    """
+        Completes the counts (see sampling_counts) to every id x object x position
+        cell of sampling_across_positions, zero-filled, and adds the rate per
+        minute of video from length (id, video_length in ms).
+    """
     all_combinations = pd.MultiIndex.from_product(
         [sampling_across_positions['id'].unique(),
          sampling_across_positions[aff_label].unique(),
@@ -207,8 +502,7 @@ def extract_sampling_per_id(DIR, sampling_across_positions, aff_label='Object',
         names=['id', aff_label, con_position]
     )
 
-    grouped = sampling_across_positions.groupby(['id', aff_label, con_position])['Duration'].agg(['count', 'sum'])
-    grouped = grouped.reindex(all_combinations).reset_index()
+    grouped = counts.reindex(all_combinations).reset_index()
     grouped['count'] = grouped['count'].fillna(0)
     grouped['sum'] = grouped['sum'].fillna(0)
     grouped['count'] = grouped['count'].astype(int)
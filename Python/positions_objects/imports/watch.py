@@ -0,0 +1,275 @@
+import asyncio
+import glob
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from imports import column_store
+from imports.import_data import combine_body, combine_manual, compute_sampling_across_positions, merge_participants, \
+    parse_file, read_length, sampling_counts, sampling_per_id_from_counts, NON_POSITION_TIERS, SAMPLING_SECONDS_DTYPES
+from profiling import profiler
+
+# Seconds a file must stay unchanged before it is parsed, so that a save in
+# progress (or a burst of saves) is processed once, and seconds between scans.
+DEBOUNCE = 2.0
+POLL_INTERVAL = 0.5
+LENGTH_FILE = 'length_T3.xlsx'
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _write_atomic(df, path):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    df.to_csv(tmp)
+    os.replace(tmp, path)
+
+
+def _empty_sampling():
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in SAMPLING_SECONDS_DTYPES.items()})
+
+
+class WatchFolder:
+    """
+        Long-running counterpart of the import, sampling and per_id stages of
+        main.run_cohort: watches the .eaf files (and length_T3.xlsx) of DIR and,
+        within seconds of a save, rewrites sampling_across_positions.csv and
+        sampling_per_id.csv in OUT_DIR (and in the column store OUT_DIR/store).
+
+        The directory is scanned every poll_interval seconds; a new, changed or
+        removed file is processed once its size and modification time have been
+        stable for debounce seconds. Files are parsed in a process pool while
+        scanning goes on, and only the participants of the processed files are
+        recomputed: their rows replace the previous ones in the sampling table
+        and in the per-id counts, which are kept in memory. A file that fails to
+        parse (e.g. saved half-way) is skipped with a warning and its previous
+        version is kept until the next save.
+
+        Parameters:
+        DIR (str): Directory with the .eaf files and length_T3.xlsx.
+        OUT_DIR (str): Directory for the outputs (created if missing).
+        executor (concurrent.futures.Executor): Pool parsing the files; a process
+                                                pool of workers processes if None.
+        workers (int): Processes parsing the files if no executor is given.
+        cache_dir (str): Optional cache of parsed files (see eaf_cache), which
+                         makes restarting the service cheap.
+        backend (str): 'pympi' or 'stream', see generateDescriptives.
+        all_overlaps (bool): See extract_sampling_across_positions.
+        debounce (float): Seconds a file must stay unchanged before it is processed.
+        poll_interval (float): Seconds between scans of DIR.
+        on_update (callable): Called with a summary dict after every update.
+    """
+
+    def __init__(self, DIR, OUT_DIR, executor=None, workers=1, cache_dir=None, backend='pympi', all_overlaps=False,
+                 debounce=DEBOUNCE, poll_interval=POLL_INTERVAL, on_update=None):
+        self.DIR = DIR
+        self.OUT_DIR = OUT_DIR
+        self.store_dir = os.path.join(OUT_DIR, 'store')
+        self.executor = executor
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.all_overlaps = all_overlaps
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.on_update = on_update
+
+        # Per-file parses, keyed like generateDescriptives by the first 7 characters of the name.
+        self.data_pos = {}
+        self.data_manual = {}
+        self.processed = {}
+        self.pending = {}
+        self.positions = None
+        self.sampling_across_positions = None
+        self.counts = None
+        self.sampling_per_id = None
+        self.updates = 0
+
+    def _scan(self):
+        """
+            Files of DIR whose signature differs from the processed one and has been
+            stable for debounce seconds; a removed file has the signature None.
+        """
+        now = time.monotonic()
+        current = {file: _signature(file) for file in glob.glob(self.DIR + '/*.eaf')}
+        length = os.path.join(self.DIR, LENGTH_FILE)
+        if os.path.exists(length) or length in self.processed:
+            current[length] = _signature(length)
+        for file in self.processed:
+            current.setdefault(file, None)
+
+        self.pending = {file: pending for file, pending in self.pending.items() if file in current}
+        ready = {}
+        for file, signature in current.items():
+            if self.processed.get(file) == signature:
+                self.pending.pop(file, None)
+                continue
+            if file not in self.pending or self.pending[file][0] != signature:
+                self.pending[file] = (signature, now)
+            elif now - self.pending[file][1] >= self.debounce:
+                ready[file] = signature
+        return ready
+
+    async def _parse(self, files):
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(self.executor, profiler.call_recorded, profiler.modes(), parse_file, file,
+                                        True, True, self.cache_dir, self.backend) for file in files]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if not isinstance(result, Exception):
+                profiler.merge(result[1])
+        return [result if isinstance(result, Exception) else result[0] for result in results]
+
+    async def process(self, ready):
+        """
+            Parses the ready files in the pool and updates the tables in a thread,
+            so that the event loop keeps scanning meanwhile.
+        """
+        start = time.perf_counter()
+        eaf_files = [file for file, signature in ready.items() if signature is not None and file.endswith('.eaf')]
+        results = await self._parse(eaf_files)
+
+        parsed = {}
+        for file, result in zip(eaf_files, results):
+            if isinstance(result, Exception):
+                warnings.warn(f"Skipping {file}: {result!r}")
+                continue
+            filename, df_pos, df_man = result
+            parsed[filename] = (df_pos, df_man)
+        removed = [os.path.basename(file)[:7] for file, signature in ready.items()
+                   if signature is None and file.endswith('.eaf')]
+
+        loop = asyncio.get_running_loop()
+        participants = await loop.run_in_executor(None, self.update, parsed, removed)
+        # Files that failed to parse are only tried again once they are saved again.
+        for file, signature in ready.items():
+            if signature is None:
+                self.processed.pop(file, None)
+            else:
+                self.processed[file] = signature
+
+        self.updates += 1
+        summary = {'files': sorted(ready), 'participants': participants,
+                   'seconds': time.perf_counter() - start}
+        if self.on_update is not None:
+            self.on_update(summary)
+        return summary
+
+    def update(self, parsed, removed=()):
+        """
+            Applies parsed files ({filename: (df_pos, df_man)}) and removed files
+            (filenames) to the tables, recomputing only their participants (all
+            participants if the set of position tiers changed), and writes the outputs.
+
+            Returns:
+            list: The recomputed participants.
+        """
+        with profiler.section('watch_update', rows_in=len(parsed) + len(removed)):
+            for filename in removed:
+                self.data_pos.pop(filename, None)
+                self.data_manual.pop(filename, None)
+            for filename, (df_pos, df_man) in parsed.items():
+                for data, df in [(self.data_pos, df_pos), (self.data_manual, df_man)]:
+                    if df is None:
+                        data.pop(filename, None)
+                    else:
+                        data[filename] = df
+
+            affected = {int(filename[:5]) for filename in list(parsed) + list(removed)}
+            positions = set().union(*(df['Tier'].unique() for df in self.data_pos.values())) - set(NON_POSITION_TIERS)
+            if positions != self.positions:
+                self.positions = positions
+                affected = {int(filename[:5]) for filename in list(self.data_pos) + list(self.data_manual)}
+
+            participants = sorted({int(filename[:5]) for filename, df in self.data_manual.items() if len(df)})
+            recomputed = self._recompute(affected)
+            self.sampling_across_positions = merge_participants(self.sampling_across_positions, recomputed,
+                                                                list(affected), participants)
+
+            counts = sampling_counts(recomputed)
+            if self.counts is not None:
+                counts = pd.concat([self.counts[~self.counts.index.get_level_values('id').isin(affected)], counts])
+            self.counts = counts
+
+            self._write()
+        return sorted(affected)
+
+    def _recompute(self, affected):
+        manual = {filename: df for filename, df in self.data_manual.items() if int(filename[:5]) in affected}
+        body = {filename: df for filename, df in self.data_pos.items() if int(filename[:5]) in affected}
+        if not any(len(df) for df in manual.values()) or not body:
+            return _empty_sampling()
+        return compute_sampling_across_positions(combine_manual(manual), combine_body(body), sorted(self.positions),
+                                                 self.all_overlaps)
+
+    def _write(self):
+        os.makedirs(self.OUT_DIR, exist_ok=True)
+        _write_atomic(self.sampling_across_positions, os.path.join(self.OUT_DIR, 'sampling_across_positions.csv'))
+        column_store.write_table(self.sampling_across_positions, self.store_dir, 'sampling_across_positions')
+        if not os.path.exists(os.path.join(self.DIR, LENGTH_FILE)):
+            return
+        # The store keeps the parsed session lengths until length_T3.xlsx changes.
+        length = read_length(self.DIR, self.store_dir)
+        self.sampling_per_id = sampling_per_id_from_counts(self.counts, self.sampling_across_positions, length)
+        _write_atomic(self.sampling_per_id, os.path.join(self.OUT_DIR, 'sampling_per_id.csv'))
+        column_store.write_table(self.sampling_per_id, self.store_dir, 'sampling_per_id')
+
+    async def run(self, stop=None, max_updates=None):
+        """
+            Watches DIR until stop (an asyncio.Event) is set, the task is cancelled
+            or max_updates updates have been made. The files present at start are
+            processed as one first update.
+        """
+        own_executor = self.executor is None
+        if own_executor:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        stop = stop or asyncio.Event()
+        task = None
+        try:
+            while not stop.is_set() and (max_updates is None or self.updates < max_updates):
+                # Changes arriving while an update runs are debounced meanwhile and
+                # make up the next update.
+                ready = self._scan()
+                if task is not None and task.done():
+                    task.result()
+                    task = None
+                    continue
+                if ready and task is None:
+                    task = asyncio.create_task(self.process(ready))
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if task is not None:
+                await task
+        finally:
+            if task is not None and not task.done():
+                task.cancel()
+            if own_executor:
+                self.executor.shutdown()
+                self.executor = None
+
+
+async def watch(jobs, workers=1, **options):
+    """
+        Runs a WatchFolder for every (DIR, OUT_DIR) in jobs concurrently, sharing
+        one process pool, and prints a line per update.
+    """
+    def report(DIR):
+        return lambda summary: print(f"Updated {DIR}: {len(summary['files'])} files, "
+                                     f"{len(summary['participants'])} participants, {summary['seconds']:.2f} s",
+                                     flush=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        services = [WatchFolder(DIR, OUT_DIR, executor=executor, on_update=report(DIR), **options)
+                    for DIR, OUT_DIR in jobs]
+        await asyncio.gather(*(service.run() for service in services))
+
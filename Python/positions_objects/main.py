@@ -1,51 +1,302 @@
-from plotting.plot_data import make_boxplots_interaction, make_boxplots_interaction_count
-from imports.import_data import extract_sampling_across_positions, extract_sampling_per_id, generateBodyDescriptives, \
-    generateManualDescriptives
-import matplotlib.pyplot as plt
-
-DIR = ''
-OUT_DIR = ''
-
-body = generateBodyDescriptives(DIR)
-manual = generateManualDescriptives(DIR)
-sampling_across_positions = extract_sampling_across_positions(DIR, body, manual)
-sampling_per_id = extract_sampling_per_id(DIR)
-
-sampling_per_id = sampling_per_id[sampling_per_id['count'] > 0].reset_index(drop=True)
-
-df_sit = sampling_across_positions[sampling_across_positions['Position'] == 'Independent sitting']
-df_non = sampling_across_positions[sampling_across_positions['Position'] == 'Other']
-
-sampling_per_id_sit = sampling_per_id[sampling_per_id['Position'] == 'Independent sitting']
-sampling_per_id_non = sampling_per_id[sampling_per_id['Position'] == 'Other']
-
-df_sit_mdn = df_sit.groupby(['id', 'Object', 'Position'])['Duration'].median().reset_index(drop=False)
-df_non_mdn = df_non.groupby(['id', 'Object', 'Position'])['Duration'].median().reset_index(drop=False)
-
-make_boxplots_interaction(df_sit_mdn, df_non_mdn,
-                          y_var='Duration',
-                          toys=['graspable', 'stationary'],
-                          colors={"graspable": "#2bc3db",
-                                  "stationary": "#bfd739"},
-                          toy_images={'graspable':
-                                            {'dino_img': plt.imread('PATH'),
-                                            'bubbles_img': plt.imread('PATH')},
-                                       'stationary':
-                                            {'klickity_img': plt.imread('PATH'),
-                                            'spinner_img': plt.imread('PATH')}},
-                          fig_size=(10, 10),
-                          )
-
-make_boxplots_interaction_count(sampling_per_id_sit, sampling_per_id_non,
-                          y_var='count_per_min',
-                          toys=['graspable', 'stationary'],
-                          colors={"graspable": "#2bc3db",
-                                  "stationary": "#bfd739"},
-                                toy_images={'graspable':
-                                                {'dino_img': plt.imread('PATH'),
-                                                 'bubbles_img': plt.imread('PATH')},
-                                            'stationary':
-                                                {'klickity_img': plt.imread('PATH'),
-                                                 'spinner_img': plt.imread('PATH')}},
-                          fig_size=(10, 10),
-                          )
\ No newline at end of file
+import argparse
+import asyncio
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from analysis.glmm import anova_type3, bootstrap_cells, cell_estimates, fit_lmm, pairwise_comparisons, power_curve
+from plotting.plot_data import render_figures, DENSE_MODES, SWARM_MAX_POINTS
+from imports import column_store
+from imports.binned_rates import extract_binned_rates, BIN_SIZES
+from imports.watch import watch, DEBOUNCE
+from imports.import_data import eaf_file_keys, extract_sampling_across_positions, extract_sampling_per_id, \
+    generateDescriptives, SAMPLING_SECONDS_DTYPES
+from profiling import profiler
+
+STAGES = ['import', 'sampling', 'per_id', 'rates', 'stats', 'plots']
+FORMATS = ['png', 'pdf', 'svg']
+
+
+def make_figures(sampling_across_positions, sampling_per_id, FIG_DIR, formats=('png',), max_points=SWARM_MAX_POINTS,
+                 dense='strip', comparisons=None):
+    """
+        Returns the (name, kwargs) figure specifications for render_figures, saving
+        to FIG_DIR/duration.<format> and FIG_DIR/count.<format>. comparisons maps a
+        figure name to its table of pairwise comparisons (see read_comparisons).
+    """
+    comparisons = comparisons or {}
+    sampling_per_id = sampling_per_id[sampling_per_id['count'] > 0].reset_index(drop=True)
+
+    df_sit = sampling_across_positions[sampling_across_positions['Position'] == 'Independent sitting']
+    df_non = sampling_across_positions[sampling_across_positions['Position'] == 'Other']
+
+    sampling_per_id_sit = sampling_per_id[sampling_per_id['Position'] == 'Independent sitting']
+    sampling_per_id_non = sampling_per_id[sampling_per_id['Position'] == 'Other']
+
+    df_sit_mdn = df_sit.groupby(['id', 'Object', 'Position'], observed=True)['Duration'].median().reset_index(drop=False)
+    df_non_mdn = df_non.groupby(['id', 'Object', 'Position'], observed=True)['Duration'].median().reset_index(drop=False)
+
+    common = dict(toys=['graspable', 'stationary'],
+                  colors={"graspable": "#2bc3db",
+                          "stationary": "#bfd739"},
+                  fig_size=(10, 10),
+                  formats=formats,
+                  max_points=max_points,
+                  dense=dense)
+    return [('duration', dict(df_sit=df_sit_mdn, df_non=df_non_mdn, y_var='Duration',
+                              out_path=os.path.join(FIG_DIR, 'duration'),
+                              comparisons=comparisons.get('duration'), **common)),
+            ('count', dict(df_sit=sampling_per_id_sit, df_non=sampling_per_id_non, y_var='count_per_min',
+                           out_path=os.path.join(FIG_DIR, 'count'),
+                           comparisons=comparisons.get('count'), **common))]
+
+
+def _save(df, OUT_DIR, store_dir, name):
+    df.to_csv(os.path.join(OUT_DIR, f'{name}.csv'))
+    column_store.write_table(df, store_dir, name)
+
+
+def _load(OUT_DIR, store_dir, name):
+    if column_store.has_table(store_dir, name):
+        return column_store.read_table(store_dir, name)
+    return pd.read_csv(os.path.join(OUT_DIR, f'{name}.csv'), index_col=0)
+
+
+def _figures_exist(OUT_DIR, formats):
+    return all(os.path.exists(os.path.join(OUT_DIR, 'figures', f'{figure}.{fmt}'))
+               for figure in ['duration', 'count'] for fmt in formats)
+
+
+def _model_data(sampling_across_positions, sampling_per_id):
+    return {'duration': (sampling_across_positions, 'Duration'),
+            'count': (sampling_per_id[sampling_per_id['count'] > 0], 'count_per_min')}
+
+
+def run_statistics(sampling_across_positions, sampling_per_id, STATS_DIR, nsim=0, workers=1, seed=0):
+    """
+        Fits the model of every figure (see analysis.glmm.fit_lmm) and writes
+        coef_, anova_, cells_ and pairs_<figure>.csv to STATS_DIR, plus power_<figure>.csv
+        and bootstrap intervals of the cells if nsim > 0.
+    """
+    os.makedirs(STATS_DIR, exist_ok=True)
+    for figure, (data, y_var) in _model_data(sampling_across_positions, sampling_per_id).items():
+        fit = fit_lmm(data, y_var=y_var)
+        fit['coef'].to_csv(os.path.join(STATS_DIR, f'coef_{figure}.csv'))
+        anova_type3(fit).to_csv(os.path.join(STATS_DIR, f'anova_{figure}.csv'))
+        pairwise_comparisons(fit).to_csv(os.path.join(STATS_DIR, f'pairs_{figure}.csv'), index=False)
+        if nsim:
+            bootstrap_cells(fit, nsim, workers, seed).to_csv(os.path.join(STATS_DIR, f'cells_{figure}.csv'), index=False)
+            power_curve(fit, nsim=nsim, workers=workers, seed=seed).to_csv(
+                os.path.join(STATS_DIR, f'power_{figure}.csv'), index=False)
+        else:
+            cell_estimates(fit).to_csv(os.path.join(STATS_DIR, f'cells_{figure}.csv'), index=False)
+
+
+def _comparisons(DIR, OUT_DIR, from_stats=False):
+    """
+        The pairs_<figure>.csv files giving the significance brackets: those in DIR
+        (exported by R/glmm.R, the model of the paper) and, only if from_stats is
+        set, those of the stats stage for figures without one, with a warning
+        that they come from the Python linear mixed model.
+    """
+    comparisons = {}
+    for figure in ['duration', 'count']:
+        path = os.path.join(DIR, f'pairs_{figure}.csv')
+        stats_path = os.path.join(OUT_DIR, 'stats', f'pairs_{figure}.csv')
+        if os.path.exists(path):
+            comparisons[figure] = path
+        elif from_stats and os.path.exists(stats_path):
+            warnings.warn(f"Significance brackets of the {figure} figure in {OUT_DIR} come from the Python LMM "
+                          f"(log(y) ~ Position * Object + (1 | id), Tukey with residual df) in {stats_path}, "
+                          f"not from the Gamma-log GLMM of R/glmm.R")
+            comparisons[figure] = stats_path
+    return comparisons
+
+
+def run_cohort(DIR, OUT_DIR, stages=STAGES, force=False, workers=1, cache_dir=None, backend='pympi',
+               icons_dir=None, profile=None, formats=('png',), figure_workers=1, max_points=SWARM_MAX_POINTS,
+               dense='strip', nsim=0, stat_workers=1, bin_sizes=BIN_SIZES, brackets_from_stats=False,
+               incremental=True):
+    """
+        Runs the selected stages for the ELAN files in DIR and writes their outputs
+        to OUT_DIR: body.csv and manual.csv (import), sampling_across_positions.csv
+        (sampling), sampling_per_id.csv (per_id), rates_<bin>s.csv for every bin
+        size (rates) and figures/<figure>.<format> (plots), and the model
+        estimates and comparisons in stats/ (stats). The significance brackets
+        of the figures come from pairs_duration.csv and pairs_count.csv in DIR
+        (R/glmm.R); figures without them get no brackets unless
+        brackets_from_stats is set. The tables are also
+        kept in the column store OUT_DIR/store (see imports.column_store), which
+        later stages and reruns load instead of the csv files. A stage whose output
+        already exists is skipped unless force is set; later stages then read it back.
+        When the import stage runs, the sampling stage only recomputes the
+        participants whose .eaf files changed since its table in the store was
+        made (see extract_sampling_across_positions), unless incremental is unset.
+
+        Parameters:
+        DIR (str): Directory with the .eaf files, length_T3.xlsx and optionally the
+                   pairs_<figure>.csv comparisons of one cohort/timepoint.
+        OUT_DIR (str): Directory for the outputs (created if missing).
+        stages (list): Stages to run, out of STAGES.
+        profile (str): Comma separated profiler modes; the report is written to
+                       OUT_DIR/profile_report.json.
+        formats (tuple): File formats the figures are saved in.
+        figure_workers (int): Processes rendering the figures.
+        max_points (int): Points per category above which the swarmplots fall back to dense.
+        dense (str): Fallback layer, out of DENSE_MODES.
+        nsim (int): Simulations of the parametric bootstrap and power curve; 0 skips them.
+        stat_workers (int): Processes running the simulations.
+        bin_sizes (list): Bin sizes (ms) of the time-binned rates.
+        brackets_from_stats (bool): Take the missing brackets from stats/, i.e. from
+                                    the Python LMM instead of the GLMM of R/glmm.R.
+        incremental (bool): Reuse the sampling rows of unchanged participants.
+
+        Returns:
+        str: OUT_DIR.
+    """
+    os.makedirs(OUT_DIR, exist_ok=True)
+    if profile:
+        modes = profile.split(',')
+        # Every cohort gets its own report, also when a process runs several of them.
+        profiler.reset()
+        profiler.enable(memory='memory' in modes, cprofile='cprofile' in modes)
+
+    store_dir = os.path.join(OUT_DIR, 'store')
+    body = manual = file_keys = None
+    if 'import' in stages and (force or not all(os.path.exists(os.path.join(OUT_DIR, name))
+                                                for name in ['body.csv', 'manual.csv'])):
+        # Keyed before parsing, so that a file saved meanwhile counts as changed next time.
+        file_keys = eaf_file_keys(DIR) if incremental else None
+        body, manual = generateDescriptives(DIR, workers=workers, cache_dir=cache_dir, backend=backend)
+        _save(body, OUT_DIR, store_dir, 'body')
+        _save(manual, OUT_DIR, store_dir, 'manual')
+
+    sampling_path = os.path.join(OUT_DIR, 'sampling_across_positions.csv')
+    sampling_across_positions = None
+    if 'sampling' in stages and (force or not os.path.exists(sampling_path)):
+        sampling_across_positions = extract_sampling_across_positions(OUT_DIR, body, manual, store_dir=store_dir,
+                                                                      file_keys=file_keys)
+        _save(sampling_across_positions, OUT_DIR, store_dir, 'sampling_across_positions')
+    elif {'per_id', 'rates', 'stats'} & set(stages) or \
+            'plots' in stages and (force or not _figures_exist(OUT_DIR, formats)):
+        sampling_across_positions = _load(OUT_DIR, store_dir, 'sampling_across_positions').astype(SAMPLING_SECONDS_DTYPES)
+
+    per_id_path = os.path.join(OUT_DIR, 'sampling_per_id.csv')
+    sampling_per_id = None
+    if 'per_id' in stages and (force or not os.path.exists(per_id_path)):
+        sampling_per_id = extract_sampling_per_id(DIR, sampling_across_positions, store_dir=store_dir)
+        _save(sampling_per_id, OUT_DIR, store_dir, 'sampling_per_id')
+    elif 'stats' in stages or 'plots' in stages and (force or not _figures_exist(OUT_DIR, formats)):
+        sampling_per_id = _load(OUT_DIR, store_dir, 'sampling_per_id')
+
+    rate_names = [f'rates_{bin_size // 1000}s' if bin_size % 1000 == 0 else f'rates_{bin_size}ms'
+                  for bin_size in bin_sizes]
+    if 'rates' in stages and (force or not all(os.path.exists(os.path.join(OUT_DIR, f'{name}.csv'))
+                                               for name in rate_names)):
+        if body is None:
+            body = _load(OUT_DIR, store_dir, 'body')
+        for bin_size, name in zip(bin_sizes, rate_names):
+            rates = extract_binned_rates(DIR, sampling_across_positions, body, bin_size, store_dir=store_dir)
+            _save(rates, OUT_DIR, store_dir, name)
+
+    STATS_DIR = os.path.join(OUT_DIR, 'stats')
+    if 'stats' in stages and (force or not os.path.exists(os.path.join(STATS_DIR, 'pairs_count.csv'))):
+        run_statistics(sampling_across_positions, sampling_per_id, STATS_DIR, nsim, stat_workers)
+
+    if 'plots' in stages and (force or not _figures_exist(OUT_DIR, formats)):
+        figures = make_figures(sampling_across_positions, sampling_per_id, os.path.join(OUT_DIR, 'figures'), formats,
+                               max_points, dense, _comparisons(DIR, OUT_DIR, brackets_from_stats))
+        render_figures(figures, icons_dir=icons_dir, workers=figure_workers)
+
+    if profile:
+        profiler.write_report(os.path.join(OUT_DIR, 'profile_report.json'))
+        profiler.disable()
+
+    return OUT_DIR
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the manual sampling analysis on one or more cohorts.')
+    parser.add_argument('inputs', nargs='+',
+                        help='Cohort/timepoint directories with .eaf files and length_T3.xlsx.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output directory; every input gets a subdirectory named after it.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--force', action='store_true', help='Rerun stages whose outputs already exist.')
+    parser.add_argument('--jobs', type=int, default=1, help='Cohorts processed concurrently.')
+    parser.add_argument('--workers', type=int, default=1, help='Processes parsing the files of a cohort.')
+    parser.add_argument('--cache-dir', help='Cache of parsed EAF files shared by all cohorts.')
+    parser.add_argument('--backend', choices=['pympi', 'stream'], default='pympi')
+    parser.add_argument('--icons', help='Directory with dino.png, bubbles.png, klickity.png and spinner.png.')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['png'],
+                        help='File formats the figures are saved in.')
+    parser.add_argument('--figure-workers', type=int, default=1,
+                        help='Processes rendering the figures of a cohort.')
+    parser.add_argument('--max-swarm-points', type=int, default=SWARM_MAX_POINTS,
+                        help='Points per category above which swarmplots are replaced by --dense.')
+    parser.add_argument('--dense', choices=DENSE_MODES, default='strip')
+    parser.add_argument('--nsim', type=int, default=0,
+                        help='Simulations of the parametric bootstrap and power curve (stats stage); 0 skips them.')
+    parser.add_argument('--stat-workers', type=int, default=1, help='Processes running the simulations.')
+    parser.add_argument('--bin-sizes', type=float, nargs='+', default=[b / 1000 for b in BIN_SIZES],
+                        help='Bin sizes (s) of the time-binned rates (rates stage).')
+    parser.add_argument('--brackets-from-stats', action='store_true',
+                        help='Without pairs_<figure>.csv in a cohort directory, take the significance brackets '
+                             'from the Python LMM of the stats stage instead of leaving them out.')
+    parser.add_argument('--full', action='store_true',
+                        help='Recompute the sampling table of every participant, not only of those whose .eaf '
+                             'files changed.')
+    parser.add_argument('--profile', help="Profiler modes, e.g. 'time' or 'memory,cprofile'.")
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and update the sampling and per-id tables as .eaf files are saved.')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help='Seconds a file must stay unchanged before --watch processes it.')
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for DIR in args.inputs:
+        OUT_DIR = os.path.join(args.output, os.path.basename(os.path.normpath(DIR)))
+        jobs.append((DIR, OUT_DIR))
+
+    if args.watch:
+        try:
+            asyncio.run(watch(jobs, workers=args.workers, cache_dir=args.cache_dir, backend=args.backend,
+                              debounce=args.debounce))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    options = dict(stages=args.stages, force=args.force, workers=args.workers, cache_dir=args.cache_dir,
+                   backend=args.backend, icons_dir=args.icons, profile=args.profile,
+                   formats=tuple(args.formats), figure_workers=args.figure_workers,
+                   max_points=args.max_swarm_points, dense=args.dense,
+                   nsim=args.nsim, stat_workers=args.stat_workers,
+                   bin_sizes=[int(b * 1000) for b in args.bin_sizes], brackets_from_stats=args.brackets_from_stats,
+                   incremental=not args.full)
+
+    failed = []
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(run_cohort, DIR, OUT_DIR, **options) for DIR, OUT_DIR in jobs]
+            for (DIR, _), future in zip(jobs, futures):
+                try:
+                    print(f'Finished {DIR} -> {future.result()}')
+                except Exception as err:
+                    print(f'Failed {DIR}: {err!r}', file=sys.stderr)
+                    failed.append(DIR)
+    else:
+        for DIR, OUT_DIR in jobs:
+            try:
+                print(f'Finished {DIR} -> {run_cohort(DIR, OUT_DIR, **options)}')
+            except Exception as err:
+                print(f'Failed {DIR}: {err!r}', file=sys.stderr)
+                failed.append(DIR)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,317 @@
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
 import matplotlib.pyplot as plt
 import seaborn as sns
+import pandas as pd
 from matplotlib.patches import ConnectionPatch
+from matplotlib.text import Annotation
+from matplotlib.transforms import Bbox
+
+from profiling import profiler
+
 plt.rcParams.update({'font.size': 18})
 
-def make_boxplots_interaction(df_sit, df_non, y_var, toys, colors, toy_images, fig_size):
+SWARM_MAX_POINTS = 300
+DENSE_MODES = ['strip', 'violin', 'subsample']
+POSITIONS = ['Independent sitting', 'Other']
+TOY_ICONS = {'graspable': ['dino', 'bubbles'],
+             'stationary': ['klickity', 'spinner']}
+
+
+@functools.lru_cache(maxsize=None)
+def _read_icon(path):
+    return plt.imread(path)
+
+
+def load_toy_images(icons_dir):
+    """
+        Reads <toy>.png for every toy in TOY_ICONS from icons_dir, in the layout the
+        plotting functions expect. Every icon is read once per process. Without
+        icons_dir the figures have no icons.
+    """
+    if icons_dir is None:
+        return {}
+    return {category: {f'{toy}_img': _read_icon(os.path.join(icons_dir, f'{toy}.png')) for toy in toys}
+            for category, toys in TOY_ICONS.items()}
+
+
+def _add_toy_icons(axes, toy_images, y):
+    if len(toy_images.keys()) != 2:
+        return
+    images = [toy_images['graspable']['bubbles_img'], toy_images['graspable']['dino_img'],
+              toy_images['stationary']['klickity_img'], toy_images['stationary']['spinner_img']]
+    image_positions = [0.1, 0.26, 0.64, 0.8]  # Adjusted positions
+    for ax in axes:
+        for xpos, img in zip(image_positions, images):
+            newax = ax.inset_axes([xpos, y, 0.1, 0.1], transform=ax.transAxes)
+            newax.imshow(img)
+            newax.axis('off')
+
+
+def _add_points(data, y_var, toys, colors, ax, max_points=SWARM_MAX_POINTS, dense='strip', seed=0):
+    """
+        Draws the points over a boxplot: a swarmplot as long as no category has more
+        than max_points points. Above that the swarm layout (roughly quadratic in
+        the points per category) is replaced by a layer whose cost is linear in
+        the points, so the boxplot and annotations stay as they are.
+
+        Parameters:
+        dense (str): Layer used above max_points: 'strip' (jittered, translucent
+                     points), 'violin' (density outline) or 'subsample' (a swarm
+                     of max_points points per category, drawn with a fixed seed
+                     and annotated with the share of points shown).
+        seed (int): Seed of the 'subsample' draw.
+    """
+    per_category = data['Object'].value_counts()
+    with profiler.section('swarmplot', rows_in=len(data)):
+        if data.empty or per_category.max() <= max_points:
+            sns.swarmplot(
+                data=data, x='Object', y=y_var, hue='Object',
+                size=6,
+                palette=colors,
+                hue_order=toys,
+                order=toys,
+                edgecolor='grey',
+                linewidth=1,
+                ax=ax
+            )
+        elif dense == 'strip':
+            sns.stripplot(
+                data=data, x='Object', y=y_var, hue='Object',
+                size=3,
+                alpha=.3,
+                jitter=.3,
+                palette=colors,
+                hue_order=toys,
+                order=toys,
+                linewidth=0,
+                ax=ax
+            )
+        elif dense == 'violin':
+            n_collections = len(ax.collections)
+            sns.violinplot(
+                data=data, x='Object', y=y_var, hue='Object',
+                inner=None,
+                cut=0,
+                linewidth=1,
+                palette=colors,
+                hue_order=toys,
+                order=toys,
+                ax=ax
+            )
+            for collection in ax.collections[n_collections:]:
+                collection.set_alpha(.3)
+        elif dense == 'subsample':
+            shuffled = data.sample(frac=1, random_state=seed)
+            sample = shuffled[shuffled.groupby('Object', observed=True).cumcount() < max_points]
+            sns.swarmplot(
+                data=sample, x='Object', y=y_var, hue='Object',
+                size=6,
+                palette=colors,
+                hue_order=toys,
+                order=toys,
+                edgecolor='grey',
+                linewidth=1,
+                ax=ax
+            )
+            for label in toys:
+                if per_category.get(label, 0) > max_points:
+                    ax.text(toys.index(label), 0.01, f'{max_points} of {per_category[label]} shown',
+                            transform=ax.get_xaxis_transform(), ha='center', va='bottom', fontsize=10)
+        else:
+            raise ValueError(f"Unknown dense mode {dense!r}; expected 'strip', 'violin' or 'subsample'.")
+
+
+def significance_label(p_value):
+    if p_value < 0.001:
+        return '***'
+    if p_value < 0.01:
+        return '**'
+    if p_value < 0.05:
+        return '*'
+    return 'ns'
+
+
+def _parse_group(level, toys):
+    level = level.strip().strip('()')
+    if level in toys:
+        return None, level
+    if ' ' in level and level.rsplit(' ', 1)[1] in toys:
+        position, toy = level.rsplit(' ', 1)
+        return position, toy
+    return level, None
+
+
+def read_comparisons(comparisons, toys=('graspable', 'stationary')):
+    """
+        Reads pairwise comparisons as exported from the emmeans pairs in R/glmm.R,
+        e.g. write_csv(as.data.frame(pairs(emm, adjust = "tukey")), "pairs.csv").
+        Every contrast ("Independent sitting graspable / Other graspable", or with
+        " - " on the link scale) compares two groups, each a Position and Object,
+        a Position (pairs over ~ Position) or an Object (pairs over ~ Object).
+
+        Parameters:
+        comparisons (str or DataFrame): Path of the csv or the table itself, with
+                                        the columns contrast and p.value.
+        toys (list): Object labels, to tell them from the Position in a level.
+
+        Returns:
+        DataFrame: position1, object1, position2, object2 (None if the group
+                   spans them) and p_value.
+    """
+    if not isinstance(comparisons, pd.DataFrame):
+        comparisons = pd.read_csv(comparisons)
+    rows = []
+    for contrast, p_value in zip(comparisons['contrast'], comparisons['p.value']):
+        sep = ' / ' if ' / ' in contrast else ' - '
+        first, second = contrast.split(sep, 1)
+        rows.append((*_parse_group(first, toys), *_parse_group(second, toys), float(p_value)))
+    return pd.DataFrame(rows, columns=['position1', 'object1', 'position2', 'object2', 'p_value'])
+
+
+def _add_significance(axes, toys, comparisons, top, positions=POSITIONS):
+    """
+        Draws a bracket with significance stars for every comparison, stacked above
+        the data: a bracket within a panel when both groups are in the same
+        position, otherwise a line across the panels. A comparison of two Objects
+        is drawn in every panel. Brackets that do not overlap share a level.
+
+        Parameters:
+        axes (list): The panel of every position in positions.
+        comparisons (DataFrame or str): See read_comparisons; None draws nothing.
+        top (float): Highest data value; the first level is placed above it.
+
+        Returns:
+        float: Top of the highest bracket (top if none were drawn).
+    """
+    if comparisons is None:
+        return top
+    comparisons = read_comparisons(comparisons, toys)
+    center = (len(toys) - 1) / 2
+
+    def ends(position, toy):
+        if position is None:
+            return [(panel, toys.index(toy)) for panel in range(len(positions))]
+        return [(positions.index(position), center if toy is None else toys.index(toy))]
+
+    brackets = []
+    for row in comparisons.itertuples(index=False):
+        if row.position1 not in positions + [None] or row.position2 not in positions + [None] or \
+                row.object1 not in list(toys) + [None] or row.object2 not in list(toys) + [None]:
+            continue
+        label = significance_label(row.p_value)
+        for (panel1, x1), (panel2, x2) in zip(ends(row.position1, row.object1), ends(row.position2, row.object2)):
+            (panel1, x1), (panel2, x2) = sorted([(panel1, x1), (panel2, x2)])
+            left, right = panel1 * (len(toys) + 1) + x1, panel2 * (len(toys) + 1) + x2
+            brackets.append((right - left, left, right, panel1, x1, panel2, x2, label))
+
+    step = 0.07 * top
+    tick = 0.3 * step
+    levels = []
+    highest = top
+    for _, left, right, panel1, x1, panel2, x2, label in sorted(brackets):
+        level = next((i for i, spans in enumerate(levels)
+                      if all(right < span_left or span_right < left for span_left, span_right in spans)), None)
+        if level is None:
+            level = len(levels)
+            levels.append([])
+        levels[level].append((left, right))
+        y = top + (level + 1) * step
+        highest = max(highest, y + step)
+
+        ax1, ax2 = axes[panel1], axes[panel2]
+        if panel1 == panel2:
+            ax1.plot([x1, x1, x2, x2], [y - tick, y, y, y - tick], color='black', linewidth=1)
+            ax1.text((x1 + x2) / 2, y, label, ha='center', va='bottom')
+            continue
+        ax1.plot([x1, x1], [y - tick, y], color='black', linewidth=1)
+        ax2.plot([x2, x2], [y - tick, y], color='black', linewidth=1)
+        ax2.figure.add_artist(ConnectionPatch(xyA=(x1, y), coordsA=ax1.transData,
+                                              xyB=(x2, y), coordsB=ax2.transData,
+                                              color='black'))
+        # The midpoint between the panels is only known once the figure is laid out
+        ax2.figure.add_artist(Annotation(
+            label, xy=(0.5, 0), ha='center', va='bottom', annotation_clip=False,
+            xycoords=lambda renderer, ax1=ax1, ax2=ax2, start=(x1, y), end=(x2, y): Bbox(
+                [ax1.transData.transform(start), ax2.transData.transform(end)])))
+    return highest
+
+
+def _finish(fig, out_path, formats):
+    """
+        Shows the figure or, given out_path, saves it as out_path.<format> for every
+        format (png, pdf, svg, ...). The figure is closed either way.
+    """
+    if out_path is None:
+        plt.show()
+    else:
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        for fmt in formats:
+            fig.savefig(f'{out_path}.{fmt}')
+    plt.close(fig)
+
+
+def _use_agg():
+    plt.switch_backend('Agg')
+
+
+@contextmanager
+def _headless():
+    """
+        Renders with the Agg backend within the block and switches back to the
+        previous backend afterwards, so that rendering from an interactive
+        session leaves its backend as it was.
+    """
+    previous = plt.get_backend()
+    _use_agg()
+    try:
+        yield
+    finally:
+        plt.switch_backend(previous)
+
+
+def _render(figure, kwargs, icons_dir):
+    FIGURES[figure](**kwargs, toy_images=load_toy_images(icons_dir))
+    return kwargs['out_path']
+
+
+def render_figures(figures, icons_dir=None, workers=1):
+    """
+        Renders figures headless (Agg backend) straight to file, in worker processes
+        if workers > 1 (whose profiler records are merged into this process). The
+        backend of the calling process is left as it was.
+
+        Parameters:
+        figures (list): (name, kwargs) pairs; name is a key of FIGURES and kwargs are
+                        the arguments of that function except toy_images, including
+                        out_path.
+        icons_dir (str): Directory with the toy icons, see load_toy_images.
+        workers (int): Number of processes rendering figures.
+
+        Returns:
+        list: out_path of every figure, in the order of figures.
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as executor:
+            futures = [executor.submit(profiler.call_recorded, profiler.modes(), _render, figure, kwargs, icons_dir)
+                       for figure, kwargs in figures]
+            paths = []
+            for future in futures:
+                path, records = future.result()
+                profiler.merge(records)
+                paths.append(path)
+            return paths
+
+    with _headless():
+        return [_render(figure, kwargs, icons_dir) for figure, kwargs in figures]
+
+
+@profiler.stage('make_boxplots_interaction')
+def make_boxplots_interaction(df_sit, df_non, y_var, toys, colors, toy_images, fig_size, out_path=None,
+                              formats=('png',), max_points=SWARM_MAX_POINTS, dense='strip', comparisons=None):
     outliers_th = 20
     print(f"Removed points greater than {outliers_th}."
           f"\nSitting: c={len(df_sit[df_sit[y_var] >= outliers_th])}, {(len(df_sit[df_sit[y_var] >= outliers_th]) * 100) / len(df_sit):.2f}%,"
@@ -30,16 +338,8 @@ def make_boxplots_interaction(df_sit, df_non, y_var, toys, colors, toy_images, f
         ax=ax1,
     )
 
-    sns.swarmplot(
-        data=df_sit_plot, x='Object', y=y_var, hue='Object',
-        size=6,
-        palette=colors,
-        hue_order=toys,
-        order=toys,
-        edgecolor='grey',
-        linewidth=1,
-        ax=ax1
-    )
+    _add_points(data=df_sit_plot, y_var=y_var, toys=toys, colors=colors, ax=ax1, max_points=max_points,
+                dense=dense)
 
     for label in toys:
         x_pos = toys.index(label)
@@ -62,75 +362,28 @@ def make_boxplots_interaction(df_sit, df_non, y_var, toys, colors, toy_images, f
         ax=ax2,
     )
 
-    sns.swarmplot(
-        data=df_non_plot, x='Object', y=y_var, hue='Object',
-        size=6,
-        palette=colors,
-        hue_order=toys,
-        order=toys,
-        edgecolor='grey',
-        linewidth=1,
-        ax=ax2
-    )
+    _add_points(data=df_non_plot, y_var=y_var, toys=toys, colors=colors, ax=ax2, max_points=max_points,
+                dense=dense)
 
     for label in toys:
         x_pos = toys.index(label)
         counts = df_non['Object'].value_counts()[label]
         ax2.text(x_pos, df_non[y_var].min() - 1.8, f'c = {counts}', ha='center', va='bottom')
 
-        # Add image icons below x-axis
-        if len(toy_images.keys()) == 2:
-            bubbles_img = toy_images['graspable']['bubbles_img']
-            dino_img = toy_images['graspable']['dino_img']
-            klickity_img = toy_images['stationary']['klickity_img']
-            spinner_img = toy_images['stationary']['spinner_img']
-
-            for ax in [ax1, ax2]:
-                image_positions = [0.1, 0.26, 0.64, 0.8]  # Adjusted positions
-                images = [bubbles_img, dino_img, klickity_img, spinner_img]
-                for xpos, img in zip(image_positions, images):
-                    newax = plt.gca().inset_axes([xpos, -0.17, 0.1, 0.1], transform=ax.transAxes)
-                    newax.imshow(img)
-                    newax.axis('off')
-
-    # Add significance lines
-    for xyA, xyB in [
-                     [(0, 19), (0, 19)],
-                     [(1, 16), (1, 16)],
-                     ]:
-        con = ConnectionPatch(xyA=xyA, coordsA=ax1.transData,
-                              xyB=xyB, coordsB=ax2.transData,
-                              color='black')
-
-
-        fig.add_artist(con)
-
-    ax1.text(0.5, 17.5, '***', ha='center', va='bottom')
-    ax2.text(0.5, 17.5, '***', ha='center', va='bottom')
-    ax2.text(0, 16, 'ns', ha='center', va='bottom')
-
-    ax1.axhline(y=17.5, xmin=0.25, xmax=0.75, color='black', linewidth=1)
-    ax2.axhline(y=17.5, xmin=0.25, xmax=0.75, color='black', linewidth=1)
-
-    ax1.axvline(x=0, ymin=0.845, ymax=0.875, color='black', linewidth=1)
-    ax1.axvline(x=1, ymin=0.845, ymax=0.875, color='black', linewidth=1)
-    ax2.axvline(x=0, ymin=0.845, ymax=0.875, color='black', linewidth=1)
-    ax2.axvline(x=1, ymin=0.845, ymax=0.875, color='black', linewidth=1)
-
-    ax1.axvline(x=1, ymin=0.77, ymax=0.80, color='black', linewidth=1)
-    ax2.axvline(x=1, ymin=0.77, ymax=0.80, color='black', linewidth=1)
 
-    ax1.axvline(x=0, ymin=0.92, ymax=0.95, color='black', linewidth=1)
-    ax2.axvline(x=0, ymin=0.92, ymax=0.95, color='black', linewidth=1)
+    # Add image icons below x-axis
+    _add_toy_icons([ax1, ax2], toy_images, y=-0.17)
 
-    ax1.text(1, 19, '***', ha='center', va='bottom')
+    # Add significance lines
+    top = _add_significance([ax1, ax2], toys, comparisons,
+                            top=max(df_sit_plot[y_var].max(), df_non_plot[y_var].max()))
 
     for ax in [ax1, ax2]:
         ax.set_facecolor("white")
         ax.set_ylabel('')
         ax.set_xlabel('')
 
-    plt.ylim([0, 20])
+    plt.ylim([0, max(outliers_th, top)])
     ax1.set_yticklabels([str(int(ytick)) if ytick % 5 == 0 else ytick for ytick in ax1.get_yticks()[:]])
     ax1.set_ylabel('Duration of a manual sampling episode [s]', fontsize=22)
 
@@ -143,9 +396,11 @@ def make_boxplots_interaction(df_sit, df_non, y_var, toys, colors, toy_images, f
     plt.xlabel('')
     plt.subplots_adjust(wspace=0.05)
 
-    plt.show()
+    _finish(fig, out_path, formats)
 
-def make_boxplots_interaction_count(df_sit, df_non, y_var, toys, colors, toy_images, fig_size):
+@profiler.stage('make_boxplots_interaction_count')
+def make_boxplots_interaction_count(df_sit, df_non, y_var, toys, colors, toy_images, fig_size, out_path=None,
+                                    formats=('png',), max_points=SWARM_MAX_POINTS, dense='strip', comparisons=None):
     df_sit_plot = df_sit.copy()
     df_non_plot = df_non.copy()
 
@@ -168,16 +423,8 @@ def make_boxplots_interaction_count(df_sit, df_non, y_var, toys, colors, toy_ima
         ax=ax1,
     )
 
-    sns.swarmplot(
-        data=df_sit_plot, x='Object', y=y_var, hue='Object',
-        size=6,
-        palette=colors,
-        hue_order=toys,
-        order=toys,
-        edgecolor='grey',
-        linewidth=1,
-        ax=ax1
-    )
+    _add_points(data=df_sit_plot, y_var=y_var, toys=toys, colors=colors, ax=ax1, max_points=max_points,
+                dense=dense)
     for label in toys:
         x_pos = toys.index(label)
         counts = df_sit['Object'].value_counts()[label]
@@ -199,69 +446,26 @@ def make_boxplots_interaction_count(df_sit, df_non, y_var, toys, colors, toy_ima
         ax=ax2,
     )
 
-    sns.swarmplot(
-        data=df_non_plot, x='Object', y=y_var, hue='Object',
-        size=6,
-        palette=colors,
-        hue_order=toys,
-        order=toys,
-        edgecolor='grey',
-        linewidth=1,
-        ax=ax2
-    )
+    _add_points(data=df_non_plot, y_var=y_var, toys=toys, colors=colors, ax=ax2, max_points=max_points,
+                dense=dense)
     for label in toys:
         x_pos = toys.index(label)
         counts = df_non['Object'].value_counts()[label]
         ax2.text(x_pos, df_non[y_var].min() - 1.5, f'n = {counts}', ha='center', va='bottom')
 
     #Add image icons below x-axis
-    if len(toy_images.keys()) == 2:
-        bubbles_img = toy_images['graspable']['bubbles_img']
-        dino_img = toy_images['graspable']['dino_img']
-        klickity_img = toy_images['stationary']['klickity_img']
-        spinner_img = toy_images['stationary']['spinner_img']
-
-        for ax in [ax1, ax2]:
-            image_positions = [0.1, 0.26, 0.64, 0.8]  # Adjusted positions
-            images = [bubbles_img, dino_img, klickity_img, spinner_img]
-            for xpos, img in zip(image_positions, images):
-                newax = plt.gca().inset_axes([xpos, -0.14, 0.1, 0.1],transform=ax.transAxes)
-                newax.imshow(img)
-                newax.axis('off')
+    _add_toy_icons([ax1, ax2], toy_images, y=-0.14)
 
     # Add significance lines
-    for xyA, xyB in [[(0.5, 31.2), (0.5, 31.2)],
-                     [(0.5, 26.1), (0.5, 26.1)],
-                     ]:
-
-        con = ConnectionPatch(xyA=xyA, coordsA=ax1.transData,
-                              xyB=xyB, coordsB=ax2.transData,
-                              color='black')
-        fig.add_artist(con)
-
-    ax1.axhline(y=30, xmin=0.25, xmax=0.75, color='black', linewidth=1)
-
-    ax1.axvline(x=0.5, ymin=0.86, ymax=0.89, color='black', linewidth=1)
-    ax1.axvline(x=0, ymin=0.82, ymax=0.855, color='black', linewidth=1)
-    ax1.axvline(x=1, ymin=0.82, ymax=0.855, color='black', linewidth=1)
-
-    ax2.axhline(y=30, xmin=0.25, xmax=0.75, color='black', linewidth=1)
-
-    ax2.axvline(x=0.5, ymin=0.86, ymax=0.89, color='black', linewidth=1)
-    ax2.axvline(x=0, ymin=0.83, ymax=0.855, color='black', linewidth=1)
-    ax2.axvline(x=1, ymin=0.83, ymax=0.855, color='black', linewidth=1)
-
-    ax1.axvline(x=0.5, ymin=0.72, ymax=0.75, color='black', linewidth=1)
-    ax2.axvline(x=0.5, ymin=0.72, ymax=0.75, color='black', linewidth=1)
-
-    plt.annotate("**", [-0.5, 31.2],  ha='center', va='bottom')
-    plt.annotate("***", [-0.5, 26.1], ha='center', va='bottom')
+    top = _add_significance([ax1, ax2], toys, comparisons,
+                            top=max(df_sit_plot[y_var].max(), df_non_plot[y_var].max()))
 
     for ax in [ax1, ax2]:
         ax.set_facecolor("white")
         ax.set_ylabel('')
         ax.set_xlabel('')
 
+    ax1.set_ylim(top=max(ax1.get_ylim()[1], top))
     ax1.set_yticklabels([str(int(ytick)) if ytick % 5 == 0 else ytick for ytick in ax1.get_yticks()[1:]])
     ax1.set_ylabel('Frequency of the manual sampling across infants [count/min]', fontsize=22)
     sns.despine(trim=True)
@@ -274,5 +478,8 @@ def make_boxplots_interaction_count(df_sit, df_non, y_var, toys, colors, toy_ima
     fig.add_artist(line)
     plt.subplots_adjust(wspace=0.05)
 
-    plt.show()
-    plt.close()
+    _finish(fig, out_path, formats)
+
+
+FIGURES = {'duration': make_boxplots_interaction,
+           'count': make_boxplots_interaction_count}
@@ -0,0 +1,245 @@
+import atexit
+import cProfile
+import copy
+import functools
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Set to a comma separated list of modes ('time', 'memory', 'cprofile') to enable
+# profiling without code changes; the report is written to the file named by
+# POSITIONS_OBJECTS_PROFILE_REPORT (profile_report.json by default) at exit.
+ENV_VAR = 'POSITIONS_OBJECTS_PROFILE'
+REPORT_ENV_VAR = 'POSITIONS_OBJECTS_PROFILE_REPORT'
+
+_enabled = False
+_memory = False
+_cprofile = None
+_stack = []
+_stages = {}
+_participants = {}
+_profiles = {}
+
+
+def enable(memory=False, cprofile=False):
+    """
+        Starts recording stages. Wall time and row counts are always recorded;
+        memory=True adds the tracemalloc peak of every stage and cprofile=True the
+        top functions of every outermost stage.
+    """
+    global _enabled, _memory, _cprofile
+    _enabled = True
+    _memory = memory
+    _cprofile = cProfile.Profile() if cprofile else None
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled, _cprofile
+    _enabled = False
+    _cprofile = None
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    _stages.clear()
+    _participants.clear()
+    _profiles.clear()
+
+
+def is_enabled():
+    return _enabled
+
+
+def _rows(value):
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(len(item) for item in value if isinstance(item, pd.DataFrame))
+    return 0
+
+
+def _rows_per_participant(value):
+    frames = value if isinstance(value, (tuple, list)) else [value]
+    counts = {}
+    for frame in frames:
+        if isinstance(frame, pd.DataFrame) and 'id' in frame.columns:
+            for participant, count in frame['id'].value_counts(sort=False).items():
+                counts[participant] = counts.get(participant, 0) + int(count)
+    return counts
+
+
+def _top_functions(profile, limit=20):
+    stats = pstats.Stats(profile, stream=io.StringIO()).sort_stats('cumulative')
+    top = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        top.append({'function': f'{os.path.basename(filename)}:{line}({function})',
+                    'ncalls': ncalls, 'tottime': tottime, 'cumtime': cumtime})
+    return sorted(top, key=lambda row: row['cumtime'], reverse=True)[:limit]
+
+
+@contextmanager
+def section(name, rows_in=0, participant=None):
+    """
+        Records the block as one call of the stage name: wall time, rows in and out
+        and, in memory mode, the peak of traced memory above what was allocated
+        when the block started. Yields a dict in which the block may set
+        'rows_out'. Does nothing when profiling is disabled.
+    """
+    record = {'rows_out': 0}
+    if not _enabled:
+        yield record
+        return
+
+    outermost = not _stack
+    base = tracemalloc.get_traced_memory()[0] if _memory else 0
+    if _memory:
+        # The peak is reset for every stage; the running peak of the enclosing
+        # stage is carried on the stack so that nesting does not lose it.
+        if _stack:
+            _stack[-1] = max(_stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    _stack.append(0)
+    if outermost and _cprofile is not None:
+        _cprofile.enable()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        if outermost and _cprofile is not None:
+            _cprofile.disable()
+            _profiles[name] = _top_functions(_cprofile)
+            _cprofile.clear()
+        carried = _stack.pop()
+        peak = max(carried, tracemalloc.get_traced_memory()[1]) if _memory else 0
+        if _memory and _stack:
+            _stack[-1] = max(_stack[-1], peak)
+
+        stage_record = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                                                 'peak_bytes': 0})
+        stage_record['calls'] += 1
+        stage_record['seconds'] += seconds
+        stage_record['rows_in'] += rows_in
+        stage_record['rows_out'] += record['rows_out']
+        stage_record['peak_bytes'] = max(stage_record['peak_bytes'], peak - base)
+
+        per_participant = _participants.setdefault(name, {})
+        if participant is not None:
+            entry = per_participant.setdefault(str(participant), {'seconds': 0.0, 'rows_out': 0, 'peak_bytes': 0})
+            entry['seconds'] += seconds
+            entry['rows_out'] += record['rows_out']
+            entry['peak_bytes'] = max(entry['peak_bytes'], peak - base)
+        for key, count in record.get('rows_per_participant', {}).items():
+            entry = per_participant.setdefault(str(key), {'rows_out': 0})
+            entry['rows_out'] += count
+
+
+def stage(name, participant=None):
+    """
+        Decorator recording every call of the function as the stage name, with the
+        rows of the DataFrames passed in and returned. participant, if given, is
+        called with the function's arguments and names the participant the call
+        belongs to. When profiling is disabled the only cost is one flag check.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            rows_in = sum(_rows(value) for value in list(args) + list(kwargs.values()))
+            key = participant(*args, **kwargs) if participant is not None else None
+            with section(name, rows_in=rows_in, participant=key) as record:
+                out = func(*args, **kwargs)
+                record['rows_out'] = _rows(out)
+                if key is None:
+                    record['rows_per_participant'] = _rows_per_participant(out)
+            return out
+        return wrapper
+    return decorator
+
+
+def modes():
+    """
+        The enabled modes, None if disabled; passed to call_recorded for work done
+        in other processes.
+    """
+    return {'memory': _memory, 'cprofile': _cprofile is not None, 'pid': os.getpid()} if _enabled else None
+
+
+def call_recorded(modes, func, *args, **kwargs):
+    """
+        Calls func in a worker process with profiling enabled in modes (see modes())
+        and returns (result, records), the report of this call only, for the
+        parent process to merge(). With modes None func runs unrecorded, and in
+        the process modes come from (e.g. from a thread pool) it is recorded in
+        place.
+    """
+    if modes is None or modes['pid'] == os.getpid():
+        return func(*args, **kwargs), None
+    reset()
+    # A forked worker inherits the stages the parent was in at the fork.
+    _stack.clear()
+    enable(memory=modes['memory'], cprofile=modes['cprofile'])
+    try:
+        result = func(*args, **kwargs)
+        # A copy, as reset() below clears the recorded dicts.
+        return result, copy.deepcopy(report())
+    finally:
+        disable()
+        reset()
+
+
+def merge(records):
+    """
+        Adds records returned by call_recorded to the stages of this process. Times
+        add up across processes, peaks are the maximum of any process.
+    """
+    if not records or not _enabled:
+        return
+    for name, other in records['stages'].items():
+        stage_record = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                                                 'peak_bytes': 0})
+        for key in ['calls', 'seconds', 'rows_in', 'rows_out']:
+            stage_record[key] += other[key]
+        stage_record['peak_bytes'] = max(stage_record['peak_bytes'], other['peak_bytes'])
+    for name, entries in records['participants'].items():
+        per_participant = _participants.setdefault(name, {})
+        for participant, other in entries.items():
+            entry = per_participant.setdefault(participant, dict.fromkeys(other, 0))
+            for key, value in other.items():
+                entry[key] = max(entry.get(key, 0), value) if key == 'peak_bytes' else entry.get(key, 0) + value
+    for name, top in records['profiles'].items():
+        functions = {row['function']: dict(row) for row in _profiles.get(name, [])}
+        for row in top:
+            merged = functions.setdefault(row['function'], {'function': row['function'], 'ncalls': 0,
+                                                            'tottime': 0.0, 'cumtime': 0.0})
+            for key in ['ncalls', 'tottime', 'cumtime']:
+                merged[key] += row[key]
+        _profiles[name] = sorted(functions.values(), key=lambda row: row['cumtime'], reverse=True)[:20]
+
+
+def report():
+    """
+        Returns the recorded stages as a JSON-serialisable dict.
+    """
+    return {'stages': _stages, 'participants': _participants, 'profiles': _profiles}
+
+
+def write_report(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+if os.environ.get(ENV_VAR):
+    _modes = {mode.strip() for mode in os.environ[ENV_VAR].split(',')}
+    enable(memory='memory' in _modes, cprofile='cprofile' in _modes)
+    atexit.register(write_report, os.environ.get(REPORT_ENV_VAR, 'profile_report.json'))
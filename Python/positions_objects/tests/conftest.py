@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pympi
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Two small coded sessions: position tiers with empty-valued episodes, in-hand
+# tiers labelled with toys (and one unanalysed label), 'Claps' and 'Undefined'.
+SESSIONS = {
+    '10002_T3.eaf': {'Sitting': [(0, 10000, ''), (20000, 30000, '')],
+                     'Prone': [(10000, 20000, '')],
+                     'Undefined': [(30000, 32000, '')],
+                     'Claps': [(0, 500, '')],
+                     'inhand_left_child': [(1000, 4000, 'dino'), (12000, 25000, 'klickity'), (26000, 27000, 'ball')],
+                     'inhand_right_child': [(5000, 8000, 'spinner'), (15000, 16000, 'bubbles')]},
+    '10001_T3.eaf': {'Supine': [(0, 6000, '')],
+                     'Sitting': [(6000, 9000, ''), (9000, 11000, '')],
+                     'Claps': [(0, 300, '')],
+                     'inhand_right_child': [(2000, 7000, 'bubbles'), (9500, 10500, 'dino')],
+                     'inhand_left_child': [(100, 200, '')]},
+}
+
+# Later versions of the directory: a new session, a recoded one and a session
+# bringing a position tier of its own.
+NEW_SESSION = {'10003_T3.eaf': {'Sitting': [(0, 40000, '')],
+                                'inhand_left_child': [(1000, 9000, 'klickity'), (20000, 30000, 'dino')]}}
+MODIFIED_SESSION = {'10002_T3.eaf': {'Sitting': [(0, 30000, '')],
+                                     'Prone': [(30000, 50000, '')],
+                                     'inhand_right_child': [(25000, 35000, 'spinner')]}}
+NEW_POSITION_TIER = {'10004_T3.eaf': {'Standing': [(0, 20000, '')],
+                                      'inhand_left_child': [(5000, 6000, 'bubbles')]}}
+
+
+def write_sessions(DIR, sessions=SESSIONS):
+    os.makedirs(DIR, exist_ok=True)
+    for name, tiers in sessions.items():
+        eaf = pympi.Elan.Eaf()
+        for tier, annotations in tiers.items():
+            eaf.add_tier(tier)
+            for start, end, value in annotations:
+                eaf.add_annotation(tier, start, end, value)
+        eaf.to_file(os.path.join(DIR, name))
+    return DIR
+
+
+@pytest.fixture(scope='session')
+def eaf_dir(tmp_path_factory):
+    return write_sessions(str(tmp_path_factory.mktemp('eaf')))
@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+from imports import column_store
+
+
+def test_non_contiguous_ids_keep_order(tmp_path):
+    df = pd.DataFrame({'id': [2, 1, 2, 3, 1], 'Object': pd.Categorical(['a', 'b', 'a', 'c', 'b']),
+                       'Tier': ['x', 'y', 'z', 'x', 'y'], 'Duration': [1.0, 2.0, 3.0, 4.0, 5.0]},
+                      index=[10, 11, 12, 13, 14])
+    column_store.write_table(df, str(tmp_path), 'table')
+
+    pd.testing.assert_frame_equal(column_store.read_table(str(tmp_path), 'table'), df)
+    # Reads by id return the rows of each id in their original order.
+    assert column_store.read_table(str(tmp_path), 'table', ids=[2, 1])['Duration'].tolist() == [1.0, 3.0, 2.0, 5.0]
+    assert np.asarray(column_store.read_column(str(tmp_path), 'table', 'Duration', id=1)).tolist() == [2.0, 5.0]
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imports.cooccurrence import joint_state_timeline
+
+DIMENSIONS = {
+    'A': {'tiers': ['A'], 'label': 'Object', 'values': ['x', 'y']},
+    'B': {'tiers': ['B'], 'label': 'Object', 'mapping': {'x': 'X', 'y': 'Y'}},
+    'P': {'tiers': ['P2', 'P1'], 'min_duration': 10},
+}
+
+
+def _episodes(seed, n_ids=6, length=600):
+    """
+        Random episodes, overlapping and nested within and across tiers.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for id in range(n_ids):
+        for tier in ['A', 'B', 'P1', 'P2']:
+            for _ in range(rng.integers(0, 12)):
+                start = int(rng.integers(0, length))
+                rows.append((id, tier, start, start + int(rng.integers(1, 200)), rng.choice(['x', 'y', 'z'])))
+    return pd.DataFrame(rows, columns=['id', 'Tier', 'StartTime', 'EndTime', 'Object'])
+
+
+def _state_at(df, id, t, spec):
+    """
+        State of a dimension at t by brute force: the first tier in priority order
+        with a kept episode lasting at t, and within it the latest started one.
+    """
+    for tier in spec['tiers']:
+        rows = df[(df['id'] == id) & (df['Tier'] == tier) & (df['StartTime'] <= t) & (df['EndTime'] > t)
+                  & (df['EndTime'] - df['StartTime'] > spec.get('min_duration', 0))]
+        state = rows['Object'] if 'label' in spec else rows['Tier']
+        if 'values' in spec:
+            state = state[state.isin(spec['values'])]
+        if 'mapping' in spec:
+            state = state.map(spec['mapping']).dropna()
+        if len(state):
+            return state.loc[rows.loc[state.index, 'StartTime'].sort_values(kind='stable').index[-1]]
+    return None
+
+
+def test_nested_episode():
+    df = pd.DataFrame({'id': [1, 1], 'Tier': ['Sitting', 'Sitting'],
+                       'StartTime': [0, 10000], 'EndTime': [100000, 20000]})
+    timeline = joint_state_timeline(df, {'Position': {'tiers': ['Sitting']}})
+    assert timeline[['id', 'StartTime', 'EndTime', 'Position']].astype(str).values.tolist() == \
+           [['1', '0', '100000', 'Sitting']]
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_matches_brute_force(seed):
+    df = _episodes(seed)
+    timeline = joint_state_timeline(df, DIMENSIONS)
+
+    for id in df['id'].unique():
+        rows = timeline[timeline['id'] == id]
+        # States only change at episode boundaries.
+        episodes = df[df['id'] == id]
+        for t in np.unique(np.concatenate([episodes['StartTime'], episodes['EndTime'], episodes['EndTime'] - 1])):
+            expected = tuple(_state_at(df, id, t, spec) for spec in DIMENSIONS.values())
+            row = rows[(rows['StartTime'] <= t) & (rows['EndTime'] > t)]
+            assert len(row) <= 1
+            got = tuple(None if pd.isna(v) else v for v in row[list(DIMENSIONS)].iloc[0]) if len(row) \
+                else (None, None, None)
+            assert got == expected, (id, t)
+
+    # Stretches are maximal: neighbours of the same participant differ in state or are apart.
+    same = (timeline['id'].shift() == timeline['id']) & (timeline['StartTime'] == timeline['EndTime'].shift()) \
+        & (timeline[list(DIMENSIONS)].astype(str) == timeline[list(DIMENSIONS)].shift().astype(str)).all(axis=1)
+    assert not same.any()
@@ -0,0 +1,31 @@
+import os
+
+import pympi
+
+from imports.eaf_stream import StreamedEaf
+
+
+def test_matches_pympi_with_reference_tiers(tmp_path):
+    eaf = pympi.Elan.Eaf()
+    eaf.add_tier('Sitting')
+    for start, end, value in [(0, 1000, 'a'), (2000, 3000, 'b'), (4000, 5000, 'c')]:
+        eaf.add_annotation('Sitting', start, end, value)
+    eaf.add_linguistic_type('symbolic', constraints='Symbolic_Association')
+    eaf.add_tier('Object', ling='symbolic', parent='Sitting')
+    eaf.add_ref_annotation('Object', 'Sitting', 500, 'dino')
+    eaf.add_ref_annotation('Object', 'Sitting', 4500, 'spinner')
+    eaf.add_tier('Colour', ling='symbolic', parent='Object')
+    eaf.add_ref_annotation('Colour', 'Object', 4500, 'red')
+    path = os.path.join(tmp_path, 'refs.eaf')
+    eaf.to_file(path)
+
+    expected = pympi.Elan.Eaf(path)
+    streamed = StreamedEaf(path)
+    assert streamed.get_tier_names() == list(expected.get_tier_names())
+    for tier in expected.get_tier_names():
+        assert sorted(streamed.get_annotation_data_for_tier(tier)) == \
+               sorted(annotation[:3] for annotation in expected.get_annotation_data_for_tier(tier))
+
+    kept = StreamedEaf(path, keep=lambda tier, value: tier == 'Object')
+    assert kept.get_annotation_data_for_tier('Object') == [(0, 1000, 'dino'), (4000, 5000, 'spinner')]
+    assert kept.get_annotation_data_for_tier('Sitting') == []
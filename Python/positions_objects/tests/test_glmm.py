@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis.glmm import anova_type3, bootstrap_cells, cell_estimates, fit_lmm, pairwise_comparisons, power_curve
+
+POSITIONS = ['Independent sitting', 'Other']
+OBJECTS = ['graspable', 'stationary']
+
+
+def _data(n_ids=12, seed=0, cells=None):
+    """
+        Log-normal durations with a random intercept per id; cells maps an id to
+        the (Position, Object) cells it has rows in, all by default.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_ids):
+        intercept = rng.normal(0, 0.3)
+        for position, object in (cells or {}).get(i, [(p, o) for p in POSITIONS for o in OBJECTS]):
+            for _ in range(rng.integers(2, 6)):
+                mean = 1 + 0.3 * (position == 'Other') + 0.2 * (object == 'stationary')
+                rows.append((10000 + i, position, object, np.exp(mean + intercept + rng.normal(0, 0.5))))
+    return pd.DataFrame(rows, columns=['id', 'Position', 'Object', 'Duration'])
+
+
+def test_empty_cell():
+    data = _data()
+    data = data[(data['Position'] != 'Other') | (data['Object'] != 'stationary')]
+    with pytest.warns(UserWarning, match='rank deficient'):
+        fit = fit_lmm(data)
+
+    assert fit['aliased'] == ['PositionOther:Objectstationary']
+    assert fit['coef'].loc['PositionOther:Objectstationary'].isna().all()
+    assert fit['coef'].drop('PositionOther:Objectstationary').notna().all().all()
+    assert 'Position:Object' not in anova_type3(fit).index
+
+    cells = cell_estimates(fit).set_index(['Position', 'Object'])
+    assert cells.loc[('Other', 'stationary')].drop('response').isna().all()
+    assert cells.drop(('Other', 'stationary'))['emmean'].notna().all()
+    pairs = pairwise_comparisons(fit)
+    assert len(pairs) == 3 and not pairs['contrast'].str.contains('Other stationary').any()
+    with pytest.warns(UserWarning, match='aliased'):
+        assert power_curve(fit, nsim=20).empty
+    assert bootstrap_cells(fit, nsim=20).set_index(['Position', 'Object'])['boot.lower'].isna().sum() == 1
+
+    # Residual degrees of freedom only count the estimated coefficients.
+    assert fit['df'] == len(data) - 3
+
+
+def test_power_curve_subsets_cover_cells():
+    # The first participants (in id order) never sit.
+    cells = {i: [('Other', o) for o in OBJECTS] for i in range(6)}
+    fit = fit_lmm(_data(n_ids=12, cells=cells))
+    curve = power_curve(fit, nsim=20, breaks=[4, 8, 12])
+    assert curve['n_ids'].tolist() == [4, 8, 12]
+    assert curve['power'].between(0, 1).all()
+
+
+def test_power_curve_skips_uncovered_subsets(monkeypatch):
+    monkeypatch.setattr('analysis.glmm.SUBSET_ATTEMPTS', 0)
+    fit = fit_lmm(_data(n_ids=12))
+    with pytest.warns(UserWarning, match='skipping'):
+        curve = power_curve(fit, nsim=20, breaks=[4, 12])
+    assert curve['n_ids'].tolist() == [12]
@@ -0,0 +1,111 @@
+import os
+
+import pandas as pd
+import pytest
+
+from imports import column_store, import_data
+from imports.import_data import calculate_sampling_across_positions, eaf_file_keys, \
+    extract_sampling_across_positions, generateBodyDescriptives, generateDescriptives, generateManualDescriptives, \
+    BODY_DTYPES, MANUAL_DTYPES, SAMPLING_SECONDS_DTYPES
+from tests.conftest import MODIFIED_SESSION, NEW_POSITION_TIER, NEW_SESSION, write_sessions
+
+
+def _frame(rows, dtypes):
+    return pd.DataFrame(rows, columns=list(dtypes)).astype(dtypes)
+
+
+BODY = _frame([(0, 6000, 6000, 'Supine', 10001, 'T'),
+               (100, 200, 100, 'inhand_left_child', 10001, 'T'),
+               (6000, 9000, 3000, 'Sitting', 10001, 'T'),
+               (9000, 11000, 2000, 'Sitting', 10001, 'T'),
+               (0, 10000, 10000, 'Sitting', 10002, 'T'),
+               (10000, 20000, 10000, 'Prone', 10002, 'T'),
+               (20000, 30000, 10000, 'Sitting', 10002, 'T'),
+               (30000, 32000, 2000, 'Undefined', 10002, 'T')], BODY_DTYPES)
+
+MANUAL = _frame([(2000, 7000, 5000, 'inhand_right_child', 'bubbles', 10001, 'T'),
+                 (9500, 10500, 1000, 'inhand_right_child', 'dino', 10001, 'T'),
+                 (1000, 4000, 3000, 'inhand_left_child', 'dino', 10002, 'T'),
+                 (5000, 8000, 3000, 'inhand_right_child', 'spinner', 10002, 'T'),
+                 (12000, 25000, 13000, 'inhand_left_child', 'klickity', 10002, 'T'),
+                 (15000, 16000, 1000, 'inhand_right_child', 'bubbles', 10002, 'T'),
+                 (26000, 27000, 1000, 'inhand_left_child', 'ball', 10002, 'T')], MANUAL_DTYPES)
+
+# Participants in order of first appearance, then position tier, then limb (left before right).
+SAMPLING = _frame([(2000, 6000, 4.0, 'inhand_right_child', 'graspable', 'Other', 10001),
+                   (12000, 20000, 8.0, 'inhand_left_child', 'stationary', 'Other', 10002),
+                   (15000, 16000, 1.0, 'inhand_right_child', 'graspable', 'Other', 10002),
+                   (1000, 4000, 3.0, 'inhand_left_child', 'graspable', 'Independent sitting', 10002),
+                   (20000, 25000, 5.0, 'inhand_left_child', 'stationary', 'Independent sitting', 10002),
+                   (5000, 8000, 3.0, 'inhand_right_child', 'stationary', 'Independent sitting', 10002)],
+                  SAMPLING_SECONDS_DTYPES)
+
+
+def test_body_and_manual_tables(eaf_dir):
+    pd.testing.assert_frame_equal(generateBodyDescriptives(eaf_dir), BODY)
+    pd.testing.assert_frame_equal(generateManualDescriptives(eaf_dir), MANUAL)
+
+
+@pytest.mark.parametrize('options', [dict(backend='stream'), dict(workers=2), dict(cache_dir='cache')])
+def test_descriptives_options(eaf_dir, tmp_path, options):
+    if 'cache_dir' in options:
+        options = dict(cache_dir=str(tmp_path / 'cache'))
+    for _ in range(2):
+        body, manual = generateDescriptives(eaf_dir, **options)
+        pd.testing.assert_frame_equal(body, BODY)
+        pd.testing.assert_frame_equal(manual, MANUAL)
+
+
+@pytest.mark.parametrize('all_overlaps', [False, True])
+def test_sampling_across_positions(all_overlaps):
+    sampling = extract_sampling_across_positions('', BODY, MANUAL, all_overlaps=all_overlaps)
+    pd.testing.assert_frame_equal(sampling, SAMPLING)
+
+
+def test_overlapping_positions():
+    body = _frame([(0, 20000, 20000, 'Sitting', 10001, 'T'),
+                   (5000, 10000, 5000, 'Sitting', 10001, 'T'),
+                   (12000, 18000, 6000, 'Sitting', 10001, 'T')], BODY_DTYPES)
+    manual = _frame([(6000, 14000, 8000, 'inhand_left_child', 'dino', 10001, 'T')], MANUAL_DTYPES)
+
+    first = calculate_sampling_across_positions(manual, body, ['Sitting'], ['dino'])
+    assert first[['StartTime', 'EndTime']].values.tolist() == [[6000, 14000]]
+
+    every = calculate_sampling_across_positions(manual, body, ['Sitting'], ['dino'], all_overlaps=True)
+    assert every[['StartTime', 'EndTime']].values.tolist() == [[6000, 14000], [6000, 10000], [12000, 14000]]
+    assert list(every.columns) == ['StartTime', 'EndTime', 'Duration', 'Tier', 'Object', 'Position', 'id']
+
+
+def test_incremental_matches_full(tmp_path, monkeypatch):
+    DIR = write_sessions(str(tmp_path / 'in'))
+    store_dir = str(tmp_path / 'store')
+    recomputed = []
+    full_sampling = import_data.compute_sampling_across_positions
+
+    def sampling(manual, body, all_positions, all_overlaps):
+        recomputed.append(sorted(manual['id'].unique()))
+        return full_sampling(manual, body, all_positions, all_overlaps)
+    monkeypatch.setattr(import_data, 'compute_sampling_across_positions', sampling)
+
+    def run(expected, all_overlaps=False):
+        file_keys = eaf_file_keys(DIR)
+        body, manual = generateDescriptives(DIR)
+        recomputed.clear()
+        incremental = extract_sampling_across_positions('', body, manual, all_overlaps, store_dir, file_keys)
+        assert recomputed == [expected]
+        column_store.write_table(incremental, store_dir, 'sampling_across_positions')
+        full = extract_sampling_across_positions('', body, manual, all_overlaps)
+        pd.testing.assert_frame_equal(incremental, full)
+
+    run([10001, 10002])
+    run([])
+    run([10001, 10002], all_overlaps=True)
+    run([], all_overlaps=True)
+    write_sessions(DIR, NEW_SESSION)
+    run([10003], all_overlaps=True)
+    write_sessions(DIR, MODIFIED_SESSION)
+    run([10002], all_overlaps=True)
+    os.remove(os.path.join(DIR, '10003_T3.eaf'))
+    run([], all_overlaps=True)
+    write_sessions(DIR, NEW_POSITION_TIER)
+    run([10001, 10002, 10004], all_overlaps=True)
@@ -0,0 +1,77 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from main import _comparisons, run_cohort
+from tests.conftest import MODIFIED_SESSION, NEW_SESSION, write_sessions
+
+
+def test_profile_report_per_cohort(tmp_path):
+    cohorts = [write_sessions(str(tmp_path / name)) for name in ['T3', 'T4']]
+    for DIR in cohorts:
+        run_cohort(DIR, os.path.join(tmp_path, 'out', os.path.basename(DIR)), stages=['import', 'sampling'],
+                   profile='time')
+
+    for DIR in cohorts:
+        with open(os.path.join(tmp_path, 'out', os.path.basename(DIR), 'profile_report.json')) as f:
+            report = json.load(f)
+        assert report['stages']['generateDescriptives']['calls'] == 1
+        assert report['stages']['extract_sampling_across_positions']['calls'] == 1
+        assert sorted(report['participants']['parse_file']) == ['10001', '10002']
+
+
+def test_brackets_from_stats_opt_in(tmp_path):
+    DIR, OUT_DIR = tmp_path / 'T3', tmp_path / 'out'
+    os.makedirs(DIR)
+    os.makedirs(OUT_DIR / 'stats')
+    for path in [DIR / 'pairs_duration.csv', OUT_DIR / 'stats' / 'pairs_duration.csv',
+                 OUT_DIR / 'stats' / 'pairs_count.csv']:
+        path.write_text('')
+
+    assert _comparisons(str(DIR), str(OUT_DIR)) == {'duration': str(DIR / 'pairs_duration.csv')}
+    with pytest.warns(UserWarning, match='Python LMM'):
+        comparisons = _comparisons(str(DIR), str(OUT_DIR), from_stats=True)
+    assert comparisons == {'duration': str(DIR / 'pairs_duration.csv'),
+                           'count': str(OUT_DIR / 'stats' / 'pairs_count.csv')}
+
+
+def test_forced_rerun_is_incremental(tmp_path):
+    DIR = write_sessions(str(tmp_path / 'T3'))
+    OUT_DIR = str(tmp_path / 'out')
+    run_cohort(DIR, OUT_DIR, stages=['import', 'sampling'])
+    write_sessions(DIR, {**NEW_SESSION, **MODIFIED_SESSION})
+    run_cohort(DIR, OUT_DIR, stages=['import', 'sampling'], force=True, profile='time')
+    run_cohort(DIR, str(tmp_path / 'full'), stages=['import', 'sampling'], profile='time', incremental=False)
+
+    # Only the new and the recoded session are clipped again.
+    rows_in = []
+    for out in [OUT_DIR, os.path.join(tmp_path, 'full')]:
+        with open(os.path.join(out, 'profile_report.json')) as f:
+            rows_in.append(json.load(f)['stages']['calculate_sampling_across_positions']['rows_in'])
+    assert rows_in[0] < rows_in[1]
+    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(OUT_DIR, 'sampling_across_positions.csv')),
+                                  pd.read_csv(os.path.join(tmp_path, 'full', 'sampling_across_positions.csv')))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_profile_report_records_workers(tmp_path, workers):
+    DIR = write_sessions(str(tmp_path / 'T3'))
+    OUT_DIR = str(tmp_path / 'out')
+    run_cohort(DIR, OUT_DIR, stages=['import'], workers=workers, profile='time,memory')
+
+    with open(os.path.join(OUT_DIR, 'profile_report.json')) as f:
+        report = json.load(f)
+    assert report['stages']['parse_file']['calls'] == 2
+    assert report['stages']['parse_file']['peak_bytes'] > 0
+    participants = report['participants']['parse_file']
+    assert sorted(participants) == ['10001', '10002']
+    assert all(entry['rows_out'] > 0 and entry['peak_bytes'] > 0 for entry in participants.values())
+
+    run_cohort(DIR, OUT_DIR, stages=['import', 'sampling'], force=True, workers=workers, profile='cprofile')
+    with open(os.path.join(OUT_DIR, 'profile_report.json')) as f:
+        profiles = json.load(f)['profiles']
+    # Every outermost stage has its top functions, in the workers too.
+    expected = {'generateDescriptives', 'extract_sampling_across_positions'} | ({'parse_file'} if workers > 1 else set())
+    assert set(profiles) == expected
@@ -0,0 +1,60 @@
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import make_figures
+from plotting import plot_data
+from plotting.plot_data import render_figures
+
+POSITIONS = ['Independent sitting', 'Other']
+OBJECTS = ['graspable', 'stationary']
+
+
+def _tables(seed=0, n_ids=8):
+    rng = np.random.default_rng(seed)
+    cells = [(id, position, object) for id in range(n_ids) for position in POSITIONS for object in OBJECTS]
+    sampling = pd.DataFrame([(id, object, position, duration) for id, position, object in cells
+                             for duration in rng.gamma(2, 2, 3)], columns=['id', 'Object', 'Position', 'Duration'])
+    per_id = pd.DataFrame([(id, object, position, count, count / 5) for id, position, object in cells
+                           for count in [int(rng.integers(1, 20))]],
+                          columns=['id', 'Object', 'Position', 'count', 'count_per_min'])
+    return sampling, per_id
+
+
+@pytest.fixture
+def pdf_backend():
+    previous = plt.get_backend()
+    plt.switch_backend('pdf')
+    yield
+    plt.switch_backend(previous)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_render_keeps_backend(tmp_path, pdf_backend, workers):
+    figures = make_figures(*_tables(), str(tmp_path))
+    paths = render_figures(figures, workers=workers)
+    assert plt.get_backend() == 'pdf'
+    assert all(os.path.exists(f'{path}.png') for path in paths)
+
+
+@pytest.mark.parametrize('figure', ['duration', 'count'])
+def test_brackets_within_limits(tmp_path, monkeypatch, figure):
+    comparisons = pd.DataFrame({'contrast': ['Independent sitting graspable / Independent sitting stationary',
+                                             'Independent sitting graspable / Other graspable',
+                                             'Independent sitting stationary / Other stationary',
+                                             'Other graspable / Other stationary'],
+                                'p.value': [0.001, 0.01, 0.02, 0.04]})
+    figures = dict(make_figures(*_tables(), str(tmp_path), comparisons={figure: comparisons}))
+    finished, tops = [], []
+    add_significance = plot_data._add_significance
+    monkeypatch.setattr(plot_data, '_add_significance', lambda *args, **kwargs: tops.append(
+        add_significance(*args, **kwargs)) or tops[-1])
+    monkeypatch.setattr(plot_data, '_finish', lambda fig, out_path, formats: finished.append(fig))
+    plot_data._render(figure, figures[figure], None)
+
+    # The axes reach up to the highest bracket, including its stars.
+    assert all(ax.get_ylim()[1] >= tops[0] for ax in finished[0].axes[:2])
+    plt.close(finished[0])
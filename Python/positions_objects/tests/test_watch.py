@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from imports.import_data import extract_sampling_across_positions, extract_sampling_per_id, generateDescriptives, \
+    parse_file
+from imports.watch import WatchFolder
+from tests.conftest import MODIFIED_SESSION, NEW_POSITION_TIER, NEW_SESSION, SESSIONS, write_sessions
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    DIR = write_sessions(str(tmp_path / 'in'))
+    ids = [10001, 10002, 10003, 10004]
+    pd.DataFrame({'id': ids, 'video_length': [20000, 40000, 60000, 30000]}).to_excel(
+        os.path.join(DIR, 'length_T3.xlsx'), index=False)
+    return DIR, str(tmp_path / 'out')
+
+
+def _update(service, DIR, names, removed=()):
+    parsed = {}
+    for name in names:
+        filename, df_pos, df_man = parse_file(os.path.join(DIR, name))
+        parsed[filename] = (df_pos, df_man)
+    return service.update(parsed, [name[:7] for name in removed])
+
+
+def _assert_full_run(service, DIR):
+    body, manual = generateDescriptives(DIR)
+    sampling = extract_sampling_across_positions(DIR, body, manual)
+    pd.testing.assert_frame_equal(service.sampling_across_positions, sampling)
+    pd.testing.assert_frame_equal(service.sampling_per_id, extract_sampling_per_id(DIR, sampling))
+    written = pd.read_csv(os.path.join(service.OUT_DIR, 'sampling_across_positions.csv'), index_col=0)
+    assert len(written) == len(sampling)
+
+
+def test_updates_match_full_runs(cohort):
+    DIR, OUT_DIR = cohort
+    service = WatchFolder(DIR, OUT_DIR)
+
+    assert _update(service, DIR, sorted(SESSIONS)) == [10001, 10002]
+    _assert_full_run(service, DIR)
+
+    write_sessions(DIR, NEW_SESSION)
+    assert _update(service, DIR, NEW_SESSION) == [10003]
+    _assert_full_run(service, DIR)
+
+    write_sessions(DIR, MODIFIED_SESSION)
+    assert _update(service, DIR, MODIFIED_SESSION) == [10002]
+    _assert_full_run(service, DIR)
+
+    os.remove(os.path.join(DIR, '10003_T3.eaf'))
+    assert _update(service, DIR, [], removed=['10003_T3.eaf']) == [10003]
+    _assert_full_run(service, DIR)
+    write_sessions(DIR, NEW_SESSION)
+    _update(service, DIR, NEW_SESSION)
+
+    # A position tier no session had before recomputes every participant.
+    write_sessions(DIR, NEW_POSITION_TIER)
+    assert _update(service, DIR, NEW_POSITION_TIER) == [10001, 10002, 10003, 10004]
+    _assert_full_run(service, DIR)
+
+    # 10001 is the only session with 'Supine', so its removal changes the position tiers too.
+    os.remove(os.path.join(DIR, '10001_T3.eaf'))
+    assert _update(service, DIR, [], removed=['10001_T3.eaf']) == [10002, 10003, 10004]
+    _assert_full_run(service, DIR)
+    assert 10001 not in set(service.sampling_across_positions['id'])
+
+
+def test_scan_debounces(cohort):
+    DIR, OUT_DIR = cohort
+    service = WatchFolder(DIR, OUT_DIR, debounce=0)
+    assert service._scan() == {}
+    ready = service._scan()
+    assert sorted(os.path.basename(file) for file in ready) == ['10001_T3.eaf', '10002_T3.eaf', 'length_T3.xlsx']
+
+    service.processed.update(ready)
+    assert service._scan() == {}
+    shutil.copy(os.path.join(DIR, '10001_T3.eaf'), os.path.join(DIR, '10009_T3.eaf'))
+    service._scan()
+    assert [os.path.basename(file) for file in service._scan()] == ['10009_T3.eaf']